@@ -6,8 +6,28 @@ from dotenv import load_dotenv
 import logging
 from langchain_openai import ChatOpenAI
 import uuid
-from langgraph.checkpoint.sqlite import SqliteSaver
-import sqlite3
+import os
+from maintenance import start_background_maintenance, DEFAULT_KEEP
+from storage import Storage, DEFAULT_DB_PATH
+from metrics import start_metrics_server
+
+
+@st.cache_resource
+def load_storage(db_path):
+    """Open the storage layer once per process, shared by every session"""
+    return Storage(db_path)
+
+
+@st.cache_resource
+def start_maintenance(db_path, interval, keep):
+    """Start the checkpoint maintenance job once per process"""
+    return start_background_maintenance(db_path, interval, keep=keep)
+
+
+@st.cache_resource
+def start_metrics(port):
+    """Serve Prometheus metrics once per process"""
+    return start_metrics_server(port)
 
 
 def main():
@@ -15,9 +35,18 @@ def main():
     load_dotenv()
     logging.basicConfig(level=logging.INFO)
 
-    # Initialize checkpoint connection (Moved here and shared)
-    conn = sqlite3.connect("checkpoints.sqlite")
-    saver = SqliteSaver(conn)
+    # Optional periodic checkpoint pruning, enabled by setting an interval in seconds
+    maintenance_interval = os.getenv("CHECKPOINT_MAINTENANCE_INTERVAL")
+    if maintenance_interval:
+        start_maintenance(DEFAULT_DB_PATH, float(maintenance_interval), int(os.getenv("CHECKPOINT_KEEP", DEFAULT_KEEP)))
+
+    # Optional Prometheus endpoint at http://localhost:<port>/metrics
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        start_metrics(int(metrics_port))
+
+    # Shared storage layer for this process
+    storage = load_storage(DEFAULT_DB_PATH)
 
     # Initialize LLM once
     if "llm" not in st.session_state:
@@ -26,52 +55,23 @@ def main():
     # Get or create assistant using checkpoints
     if "assistant" not in st.session_state:
         
-        # First check if there are any checkpoints in the database
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM checkpoints")
-            count = cur.fetchone()[0]
-            
-            if count > 0:
-                # Get the most recent checkpoint
-                cur.execute("SELECT thread_id FROM checkpoints ORDER BY ROWID DESC LIMIT 1")
-                thread_id = cur.fetchone()[0]
-                
-                st.session_state.assistant = Assistant(
-                    llm=st.session_state.llm,
-                    thread_id=thread_id
-                )
-                
-                # Store current session in session state
-                st.session_state.current_session = {
-                    "id": thread_id,
-                }
-            else:
-                # Create new session with proper thread_id linkage
-                thread_id = str(uuid.uuid4())
-                st.session_state.assistant = Assistant(
-                    llm=st.session_state.llm,
-                    thread_id=thread_id
-                )
-                
-                # Store current session in session state
-                st.session_state.current_session = {
-                    "id": thread_id,
-                }
-        except sqlite3.OperationalError as e:
-            # Handle case where table doesn't exist yet
-            thread_id = str(uuid.uuid4())
-            st.session_state.assistant = Assistant(
-                llm=st.session_state.llm,
-                thread_id=thread_id
-            )
-            
-            # Store current session in session state
-            st.session_state.current_session = {
-                "id": thread_id,
-            }
-
-    gui = AssistantGUI(st.session_state.assistant, conn)  # Pass connection
+        # Resume the most recently updated thread, or start a new one
+        latest = storage.catalog.list_threads(limit=1)
+        thread_id = latest[0]["thread_id"] if latest else str(uuid.uuid4())
+        
+        st.session_state.assistant = Assistant(
+            llm=st.session_state.llm,
+            thread_id=thread_id,
+            storage=storage
+        )
+        
+        # Store current session in session state
+        st.session_state.current_session = {
+            "id": thread_id,
+        }
+
+    debug_panel = os.getenv("ASSISTANT_DEBUG_PANEL", "").lower() in ("1", "true")
+    gui = AssistantGUI(st.session_state.assistant, storage, debug_panel=debug_panel)
     gui.render()
 
    
@@ -1,106 +1,577 @@
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import MessagesState
 from langchain_core.messages import HumanMessage, SystemMessage, RemoveMessage
 from langgraph.graph import MessagesState
 from typing import List
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import partial
+import argparse
+import os
 import logging
-import sqlite3
-from langgraph.checkpoint.sqlite import SqliteSaver
+import time
+import threading
+import asyncio
+import queue
+import weakref
+from storage import Storage
+from retrieval import CHUNK_CHARS
+from metrics import recorder
+from transcript import content_text
+from tokens import count_tokens, message_tokens, truncate_tokens, with_token_count, MESSAGE_OVERHEAD_TOKENS
 from prompts import (
     MEMORY_SYSTEM_PROMPT, 
     INITIAL_SYSTEM_PROMPT, 
+    RETRIEVAL_PROMPT,
     SUMMARY_WITH_EXISTING, 
     INITIAL_SUMMARY_PROMPT,
+    MERGE_SUMMARY_PROMPT,
     TITLE_GENERATION_PROMPT
 )
 
 
 load_dotenv()
 
+# Summarize once the prompt exceeds this many tokens, unset falls back to memoryLenght
+DEFAULT_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "0")) or None
+
+# Archived snippets recalled into the chat prompt, 0 disables retrieval
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+
+# LLM call sites answered from the response cache: any of title, summary, chat
+LLM_CACHE_SITES = frozenset(site for site in os.getenv("LLM_CACHE_SITES", "").split(",") if site)
+
+# Hard ceiling on the summary injected into the chat prompt
+SUMMARY_TOKEN_CEILING = 1000
+
+# Recent summary segments are merged into the older summary past this size
+SUMMARY_SEGMENTS_TOKEN_CAP = 500
+
+# Size the merged older summary is kept under
+SUMMARY_BASE_TOKENS = 400
+
+# Number of latest-state snapshots kept in memory per assistant
+STATE_CACHE_SIZE = 32
+
+# Background titles and summaries are shared by every assistant in the process,
+# entries are dropped once they finish
+_pending_summaries = {}
+_pending_titles = {}
+# Per event loop, thread id -> [asyncio.Lock, number of holders and waiters]
+_thread_locks = weakref.WeakKeyDictionary()
+_registry_lock = threading.Lock()
+# Event loop running the sync API, started on first use
+_loop = None
+
+
+@asynccontextmanager
+async def _thread_lock(thread_id):
+    """Hold the lock serializing graph writes for a thread on the running event loop.
+
+    The lock is forgotten once nobody holds or waits for it.
+    """
+    loop = asyncio.get_running_loop()
+    with _registry_lock:
+        locks = _thread_locks.setdefault(loop, {})
+        entry = locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        with _registry_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del locks[thread_id]
+
+
+def _forget(registry, thread_id, future):
+    """Done callback dropping a finished background job from its registry"""
+    with _registry_lock:
+        if registry.get(thread_id) is future:
+            del registry[thread_id]
+
+
+def _background_loop():
+    """Return the process-wide event loop the sync API runs its coroutines on"""
+    global _loop
+    with _registry_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="assistant-loop", daemon=True).start()
+        return _loop
+
+
+def _iterate_sync(agen):
+    """Run an async generator on the background loop and yield its items in this thread"""
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((True, item))
+            items.put((False, None))
+        except BaseException as e:
+            items.put((False, e))
+
+    asyncio.run_coroutine_threadsafe(pump(), _background_loop())
+    while True:
+        ok, item = items.get()
+        if ok:
+            yield item
+        elif item is None:
+            return
+        else:
+            raise item
+
+
+def _spawn(coro):
+    """Start a background job on the running loop, the future can be waited on from any thread"""
+    return asyncio.run_coroutine_threadsafe(coro, asyncio.get_running_loop())
+
 
 class AssistantState(MessagesState):
+    # Older, consolidated summary
     summary: str
+    # Summaries of recent summarization steps, oldest first
+    summary_segments: List = []
+    # Legacy: archived messages now live in the transcript table
     full_history: List = []
     title: str = ""
 
 
+def _dispatch(method):
+    """Wrap an async Assistant method as a node that runs on the assistant in the config"""
+    async def node(state, config: RunnableConfig):
+        with recorder.timed("node", method.lstrip("_"), config["configurable"]["thread_id"]):
+            return await getattr(config["configurable"]["assistant"], method)(state, config)
+    return node
+
+
+def _route(method):
+    """Wrap an Assistant method as a conditional edge"""
+    def route(state, config: RunnableConfig):
+        return getattr(config["configurable"]["assistant"], method)(state, config)
+    return route
+
+
+def build_graph(checkpointer=None):
+    """Compile the assistant graph once per checkpointer and share it across assistants.
+
+    Nodes are async, so the graph runs with ainvoke/astream. Compiled with the
+    sync saver it still serves get_state for synchronous reads. The graph is
+    kept on the checkpointer, so both are released together.
+    """
+    graph = getattr(checkpointer, "_assistant_graph", None)
+    if graph is None:
+        graph = _compile_graph(checkpointer)
+        if checkpointer is not None:
+            checkpointer._assistant_graph = graph
+    return graph
+
+
+def _compile_graph(checkpointer):
+    builder = StateGraph(AssistantState)
+    
+    builder.add_node("chat", _dispatch("_chat"))
+    builder.add_node("summarize_conversation", _dispatch("_summarize_conversation"))
+    # Only reached through update_state when a background title lands
+    builder.add_node("set_title", _dispatch("_set_title"))
+
+    builder.add_edge(START, "chat")
+    builder.add_conditional_edges("chat", _route("_should_summarize"), ["summarize_conversation", END])
+    builder.add_edge("summarize_conversation", END)
+    builder.add_edge("set_title", END)
+
+    return builder.compile(checkpointer=checkpointer)
+
+
+def export_graph(path="graph.png"):
+    """Render the graph diagram to a PNG, this calls the mermaid.ink web service"""
+    with open(path, "wb") as f:
+        f.write(build_graph().get_graph().draw_mermaid_png())
+
+
 class Assistant:
-    def __init__(self, llm, thread_id=None, memoryLenght=10 ):
-        self.conn = sqlite3.connect("checkpoints.sqlite",check_same_thread=False)
-        self.memory = SqliteSaver(self.conn)
+    def __init__(self, llm, thread_id=None, memoryLenght=10, deferred_summary=True, storage=None,
+                 token_budget=DEFAULT_TOKEN_BUDGET, retrieval_k=RETRIEVAL_TOP_K, cache_sites=LLM_CACHE_SITES,
+                 serde=None):
+        # Share one Storage across assistants, a private one is opened otherwise,
+        # checkpointing with `serde` if given (CompactSerializer by default)
+        self.storage = storage or Storage(serde=serde)
+        self.conn = self.storage.conn
+        self.memory = self.storage.saver
         self.llm = llm 
         self.thread_id = thread_id 
         self.memoryLenght = memoryLenght
-        self.graph = self._init_graph()
+        # When set, summarize by prompt size in tokens instead of message count
+        self.token_budget = token_budget
+        # Number of archived snippets recalled for each user message
+        self.retrieval_k = retrieval_k
+        # Call sites whose LLM responses are reused from storage.llm_cache
+        self.cache_sites = frozenset(cache_sites)
+        # Summarize in a background worker instead of inside the reply's graph run
+        self.deferred_summary = deferred_summary
+        # The compiled graph is shared, nodes find this assistant in the config.
+        # This one reads state synchronously, replies run on _async_graph()
+        self.graph = build_graph(self.memory)
         self.config = {
-            "configurable": {"thread_id": self.thread_id}
+            "configurable": {"thread_id": self.thread_id, "assistant": self}
         }
+        self._state_cache = OrderedDict()
+        self._state_cache_lock = threading.Lock()
+        # Timings of the last response, e.g. time_to_first_token and response_time
+        self.last_metrics = {}
+        # Input and output sizes of recent summarization steps
+        self.summary_log = deque(maxlen=100)
       
+    async def _async_graph(self):
+        """Return the graph checkpointing through the running loop's async saver"""
+        return build_graph(await self.storage.async_saver())
 
-    def _init_graph(self):
-        builder = StateGraph(AssistantState)
-        
-        builder.add_node("chat", self._chat)
-        builder.add_node("summarize_conversation", self._summarize_conversation)
+    async def _invoke_llm(self, site, messages):
+        """Call the LLM, through the response cache if it is enabled for this call site"""
+        with recorder.timed("llm", site, self.thread_id) as event:
+            response = None
+            if site in self.cache_sites:
+                cache = self.storage.llm_cache
+                key = cache.key(self.llm, messages)
+                response = await asyncio.to_thread(cache.get, key, site)
+                event["cached"] = response is not None
+            if response is None:
+                response = await self.llm.ainvoke(messages)
+                if site in self.cache_sites:
+                    await asyncio.to_thread(cache.put, key, response)
+            # Prefer the provider's usage, estimate when it doesn't report any
+            usage = getattr(response, "usage_metadata", None) or {}
+            event["input_tokens"] = usage.get("input_tokens") or sum(message_tokens(m) for m in messages)
+            event["output_tokens"] = usage.get("output_tokens") or count_tokens(content_text(response.content))
+        return response
 
-        builder.add_edge(START, "chat")
-        builder.add_conditional_edges("chat", self._should_summarize)
-        builder.add_edge("summarize_conversation", END)
+    def _system_prompt(self, summary):
+        if summary:
+            return MEMORY_SYSTEM_PROMPT.format(summary=summary)
+        return INITIAL_SYSTEM_PROMPT
+
+    def _recall(self, thread_id, messages):
+        """Find archived snippets of the thread relevant to the latest user message"""
+        query = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        if not self.retrieval_k or query is None:
+            return ""
+        with recorder.timed("storage", "recall", thread_id):
+            results = self.storage.vectors.search(thread_id, content_text(query.content), k=self.retrieval_k)
+        if not results:
+            return ""
+        return RETRIEVAL_PROMPT.format(snippets="\n\n".join(text for _, text in results))
+
+    async def _chat(self, state: AssistantState, config: RunnableConfig = None):
+        thread_id = (config or self.config)["configurable"]["thread_id"]
+        system_prompt = self._system_prompt(self._render_summary(state))
+        system_prompt += await asyncio.to_thread(self._recall, thread_id, state["messages"])
+        messages = [SystemMessage(content=system_prompt)] + state["messages"]
+
+        response = await self._invoke_llm("chat", messages)
+        result = {"messages": [response]}
+        if self.token_budget:
+            # Save counts with this checkpoint: uncounted messages come back as
+            # counted copies, which replace them by id, the input is left as is
+            recounted = []
+            for message in state["messages"]:
+                counted = with_token_count(message)
+                if counted is not message:
+                    recounted.append(counted)
+            result["messages"] = recounted + [with_token_count(response)]
+        # Drop a legacy full_history once it has been migrated to the transcript
+        if state.get("full_history"):
+            result["full_history"] = []
+        return result
+
+    async def _set_title(self, state: AssistantState, config: RunnableConfig = None):
+        return {}
+
+    def _render_summary(self, state):
+        """Build the summary for the prompt, newest segments first, within SUMMARY_TOKEN_CEILING"""
+        budget = SUMMARY_TOKEN_CEILING
+        parts = []
+        for segment in reversed(state.get("summary_segments") or []):
+            tokens = count_tokens(segment)
+            if tokens > budget:
+                # Keep what fits of the overflowing segment rather than dropping everything
+                if budget > 0:
+                    parts.insert(0, truncate_tokens(segment, budget))
+                break
+            parts.insert(0, segment)
+            budget -= tokens
+        else:
+            summary = state.get("summary", "")
+            if summary and budget > 0:
+                parts.insert(0, truncate_tokens(summary, budget))
+        return "\n".join(parts)
 
-        self.graph = builder.compile(
-            checkpointer=self.memory,
+    async def _merge_summaries(self, summary, segments):
+        """Fold recent summary segments into the older summary"""
+        merge_prompt = MERGE_SUMMARY_PROMPT.format(
+            summary=summary or "(none)",
+            segments="\n".join(f"- {segment}" for segment in segments),
+            # Roughly 3 words per 4 tokens
+            max_words=SUMMARY_BASE_TOKENS * 3 // 4,
         )
-        with open("graph.png", "wb") as f:
-            f.write(self.graph.get_graph().draw_mermaid_png())
-        return self.graph
+        response = await self._invoke_llm("summary", [HumanMessage(content=merge_prompt)])
+        return truncate_tokens(response.content.strip(), SUMMARY_BASE_TOKENS)
 
-    def _chat(self, state: AssistantState):
-        summary = state.get("summary", "")
-        if summary:
-            system_prompt = MEMORY_SYSTEM_PROMPT.format(summary=summary)
-            messages = [SystemMessage(content=system_prompt)] + state["messages"]
+    async def _update_summary(self, messages, state, thread_id):
+        """Summarize messages into a new segment, merging older segments past the cap.
+
+        Returns the state update for the summary fields.
+        """
+        context = self._render_summary(state)
+        # Roughly 3 words per 4 tokens
+        max_words = SUMMARY_SEGMENTS_TOKEN_CAP * 3 // 4
+        if context:
+            summary_prompt = SUMMARY_WITH_EXISTING.format(summary=context, max_words=max_words)
         else:
-            messages = [SystemMessage(content=INITIAL_SYSTEM_PROMPT)] + state["messages"]
+            summary_prompt = INITIAL_SUMMARY_PROMPT.format(max_words=max_words)
 
-        response = self.llm.invoke(messages)
-        return {"messages": [response]}
+        prompt = messages + [HumanMessage(content=summary_prompt)]
+        response = await self._invoke_llm("summary", prompt)
+        # The model may ignore the word limit, a single segment never exceeds the cap
+        segment = truncate_tokens(response.content.strip(), SUMMARY_SEGMENTS_TOKEN_CAP)
 
-    def _summarize_conversation(self, state: AssistantState):
         summary = state.get("summary", "")
-        
-        # Store the full conversation history before removing messages
-        full_history = state.get("full_history", [])
-        # Add current messages to full history (excluding the last 2 we'll keep)
-        full_history.extend([m for m in state["messages"][:-2]])
-        
-        if summary:
-            summary_prompt = SUMMARY_WITH_EXISTING.format(summary=summary)
-        else:
-            summary_prompt = INITIAL_SUMMARY_PROMPT
+        segments = list(state.get("summary_segments") or []) + [segment]
+        merged = False
+        # Also merge a summary grown unbounded by older versions of the app
+        if (sum(count_tokens(s) for s in segments) > SUMMARY_SEGMENTS_TOKEN_CAP
+                or count_tokens(summary) > SUMMARY_BASE_TOKENS):
+            summary = await self._merge_summaries(summary, segments[:-1])
+            segments = segments[-1:]
+            merged = True
+
+        update = {"summary": summary, "summary_segments": segments}
+        record = {
+            "thread_id": thread_id,
+            "input_tokens": sum(message_tokens(m) for m in prompt),
+            "output_tokens": count_tokens(segment),
+            "summary_tokens": count_tokens(self._render_summary(update)),
+            "merged": merged,
+        }
+        self.summary_log.append(record)
+        logging.info(f"Summarization step: {record}")
+        return update
+
+    def _archive(self, thread_id, messages):
+        """Move pruned messages to the transcript and the retrieval index"""
+        with recorder.timed("storage", "archive", thread_id, messages=len(messages)):
+            self.memory.archive_messages(thread_id, messages)
+            self.storage.vectors.add(thread_id, messages)
 
-        messages = state["messages"] + [HumanMessage(content=summary_prompt)]
-        response = self.llm.invoke(messages)
+    async def _summarize_conversation(self, state: AssistantState, config: RunnableConfig):
+        thread_id = config["configurable"]["thread_id"]
+        summary_update = await self._update_summary(state["messages"], state, thread_id)
 
+        # Archive the messages we remove to the transcript (excluding the last 2 we'll keep)
+        await asyncio.to_thread(self._archive, thread_id, state["messages"][:-2])
         delete_messages = [RemoveMessage(id=m.id) for m in state["messages"][:-2]]
         
         return {
-            "summary": f"{summary}\n{response.content}".strip(), 
+            **summary_update,
             "messages": delete_messages,
-            "full_history": full_history
         }
 
+    def _retrieval_reserve(self):
+        """Tokens kept free for the excerpts recalled into the next prompt, at most retrieval_k chunks"""
+        if not self.retrieval_k:
+            return 0
+        # Roughly 4 characters per token
+        return count_tokens(RETRIEVAL_PROMPT.format(snippets="")) + self.retrieval_k * CHUNK_CHARS // 4
+
+    def _context_tokens(self, state):
+        """Count the tokens of the chat prompt: system prompt with summary and recalled excerpts, then messages"""
+        system_prompt = self._system_prompt(self._render_summary(state))
+        tokens = count_tokens(system_prompt) + self._retrieval_reserve() + MESSAGE_OVERHEAD_TOKENS
+        return tokens + sum(message_tokens(m) for m in state.get("messages", []))
+
+    def _needs_summary(self, state):
+        messages = state.get("messages", [])
+        if self.token_budget:
+            # Summarizing keeps the last 2 messages, so there must be more to prune
+            return len(messages) > 2 and self._context_tokens(state) > self.token_budget
+        return len(messages) > self.memoryLenght
+
     # conditional edge that sends to summary only of more than 6 messages
-    def _should_summarize(self, state: AssistantState):
+    def _should_summarize(self, state: AssistantState, config: RunnableConfig = None):
         """
         Check if we should summarize the conversation.
         """
-        messages = state["messages"]
-        if len(messages) > self.memoryLenght:
+        # In deferred mode the summary runs after the reply, see _schedule_summary
+        if not self.deferred_summary and self._needs_summary(state):
             return "summarize_conversation"
         return END
 
-    def generate_title(self, message_content):
+    async def _schedule_summary(self):
+        """Summarize the thread in the background if it outgrew the memory window"""
+        state = await self.aget_latest_state()
+        if state is None or not self._needs_summary(state.values):
+            return
+
+        thread_id = self.thread_id
+        with _registry_lock:
+            pending = _pending_summaries.get(thread_id)
+            if pending is not None and not pending.done():
+                return
+            future = _pending_summaries[thread_id] = _spawn(self._run_deferred_summary(thread_id, state.values))
+        # Added outside the registry lock, the callback takes it
+        future.add_done_callback(partial(_forget, _pending_summaries, thread_id))
+
+    async def _run_deferred_summary(self, thread_id, values):
+        """Summarize a state snapshot and commit it as a follow-up checkpoint"""
+        with recorder.timed("background", "summary", thread_id):
+            await self._apply_deferred_summary(thread_id, values)
+
+    async def _apply_deferred_summary(self, thread_id, values):
+        try:
+            messages = values["messages"]
+            summarized = messages[:-2]
+            # The slow LLM call runs without holding the thread lock
+            summary_update = await self._update_summary(messages, values, thread_id)
+
+            graph = await self._async_graph()
+            config = {"configurable": {"thread_id": thread_id}}
+            async with _thread_lock(thread_id):
+                # The user may have sent more messages meanwhile, so apply the
+                # summary on top of the latest state rather than the snapshot
+                latest = (await graph.aget_state(config)).values
+                if (latest.get("summary", ""), latest.get("summary_segments")) != (values.get("summary", ""), values.get("summary_segments")):
+                    logging.info(f"Discarding stale summary for thread {thread_id}")
+                    return
+                current_ids = {m.id for m in latest.get("messages", [])}
+                pruned = [m for m in summarized if m.id in current_ids]
+                if not pruned:
+                    return
+                await asyncio.to_thread(self._archive, thread_id, pruned)
+                await graph.aupdate_state(
+                    config,
+                    {
+                        **summary_update,
+                        "messages": [RemoveMessage(id=m.id) for m in pruned],
+                    },
+                    as_node="summarize_conversation",
+                )
+        except Exception:
+            logging.exception(f"Deferred summarization failed for thread {thread_id}")
+
+    def _schedule_title(self, message_content):
+        """Generate the thread title in the background while the reply streams"""
+        thread_id = self.thread_id
+        with _registry_lock:
+            pending = _pending_titles.get(thread_id)
+            if pending is not None and not pending.done():
+                return
+            future = _pending_titles[thread_id] = _spawn(self._run_title(thread_id, message_content))
+        future.add_done_callback(partial(_forget, _pending_titles, thread_id))
+
+    async def _run_title(self, thread_id, message_content):
+        """Generate a title and merge it into the thread's latest state"""
+        with recorder.timed("background", "title", thread_id):
+            await self._apply_title(thread_id, message_content)
+
+    async def _apply_title(self, thread_id, message_content):
+        try:
+            title = await self.agenerate_title(message_content)
+
+            graph = await self._async_graph()
+            config = {"configurable": {"thread_id": thread_id}}
+            async with _thread_lock(thread_id):
+                values = (await graph.aget_state(config)).values
+                # The thread was deleted meanwhile, writing would bring it back
+                if not values.get("messages"):
+                    return
+                # Keep a title that landed from an earlier attempt
+                if values.get("title"):
+                    return
+                await graph.aupdate_state(config, {"title": title}, as_node="set_title")
+        except Exception:
+            logging.exception(f"Title generation failed for thread {thread_id}")
+
+    async def adelete_thread(self, thread_id=None):
+        """Delete a thread, serialized with its background title and summary writes"""
+        thread_id = thread_id or self.thread_id
+        async with _thread_lock(thread_id):
+            await asyncio.to_thread(self.memory.delete_thread, thread_id)
+
+    def delete_thread(self, thread_id=None):
+        """Blocking wrapper around adelete_thread"""
+        return asyncio.run_coroutine_threadsafe(self.adelete_thread(thread_id), _background_loop()).result()
+
+    def _pending_background(self):
+        with _registry_lock:
+            return [
+                registry.get(self.thread_id)
+                for registry in (_pending_titles, _pending_summaries)
+                if registry.get(self.thread_id) is not None
+            ]
+
+    def wait_for_background(self, timeout=None):
+        """Block until this thread's pending background title and summary have landed"""
+        for future in self._pending_background():
+            future.result(timeout=timeout)
+
+    async def await_background(self):
+        """Wait for this thread's pending background title and summary without blocking the loop"""
+        for future in self._pending_background():
+            await asyncio.wrap_future(future)
+
+    def _cached_state(self, key):
+        with self._state_cache_lock:
+            if key in self._state_cache:
+                self._state_cache.move_to_end(key)
+                return self._state_cache[key]
+        return None
+
+    def _cache_state(self, key, snapshot):
+        with self._state_cache_lock:
+            self._state_cache[key] = snapshot
+            if len(self._state_cache) > STATE_CACHE_SIZE:
+                self._state_cache.popitem(last=False)
+
+    def get_latest_state(self, thread_id=None):
+        """Return the latest state snapshot of a thread, or None if it has no checkpoints.
+
+        Only the latest checkpoint is loaded, and snapshots are memoized per
+        (thread_id, checkpoint_id) so repeated reads in the same run are free.
+        """
+        thread_id = thread_id or self.thread_id
+        checkpoint_id = self.memory.get_latest_checkpoint_id(thread_id)
+        if checkpoint_id is None:
+            return None
+
+        key = (thread_id, checkpoint_id)
+        snapshot = self._cached_state(key)
+        if snapshot is None:
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_id": checkpoint_id}}
+            snapshot = self.graph.get_state(config)
+            self._cache_state(key, snapshot)
+        return snapshot
+
+    async def aget_latest_state(self, thread_id=None):
+        """Async get_latest_state, reading through the running loop's async saver"""
+        thread_id = thread_id or self.thread_id
+        saver = await self.storage.async_saver()
+        checkpoint_id = await saver.aget_latest_checkpoint_id(thread_id)
+        if checkpoint_id is None:
+            return None
+
+        key = (thread_id, checkpoint_id)
+        snapshot = self._cached_state(key)
+        if snapshot is None:
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_id": checkpoint_id}}
+            snapshot = await build_graph(saver).aget_state(config)
+            self._cache_state(key, snapshot)
+        return snapshot
+
+    async def agenerate_title(self, message_content):
         """Generate a short title based on the first message"""
         title_prompt = TITLE_GENERATION_PROMPT.format(message_content=message_content)
         
@@ -108,7 +579,7 @@ class Assistant:
         messages = [HumanMessage(content=title_prompt)]
         
         # Get title from LLM
-        response = self.llm.invoke(messages)
+        response = await self._invoke_llm("title", messages)
         
         # Clean up the title (remove quotes, newlines, etc.)
         title = response.content.strip().strip('"\'').strip()
@@ -119,40 +590,73 @@ class Assistant:
         
         return title
 
-    def get_response(self, user_input):
-        """Generate streaming response for user input"""
+    def generate_title(self, message_content):
+        """Blocking wrapper around agenerate_title"""
+        return asyncio.run_coroutine_threadsafe(
+            self.agenerate_title(message_content), _background_loop()
+        ).result()
+
+    async def aget_response(self, user_input, stream=True):
+        """Yield the response to user input, token by token when streaming.
+
+        Replies of different threads run concurrently on one event loop,
+        messages of the same thread are serialized by its lock.
+        """
+        start_time = time.perf_counter()
+        started_at = time.time()
+        self.last_metrics = {}
         try:
-            input_message = HumanMessage(content=user_input)
-            
             # Check if this is the first message (no title yet)
-            config = {"configurable": {"thread_id": self.thread_id}}
-            checkpoints = list(self.graph.get_state_history(config))
-            
-            # Generate title if this is the first message
-            if not checkpoints or (checkpoints and not checkpoints[0].values.get("title")):
-                # Generate a title
-                title = self.generate_title(user_input)
-                
-                # The response will include the title in the state
-                response = self.graph.invoke(
-                    {"messages": [input_message], "title": title}, 
-                    config=self.config
-                )
-            else:
-                # Normal response without changing title
-                response = self.graph.invoke(
-                    {"messages": [input_message]}, 
-                    config=self.config
-                )
-            
-            ai_response = response["messages"][-1].content
-
-            def response_generator():
-                yield ai_response
-            
-            return response_generator()
-            
+            state = await self.aget_latest_state()
+
+            # Generate title if this is the first message, without delaying the reply
+            if state is None or not state.values.get("title"):
+                self._schedule_title(user_input)
+
+            graph = await self._async_graph()
+            graph_input = {"messages": [HumanMessage(content=user_input)]}
+            async with _thread_lock(self.thread_id):
+                if stream:
+                    async for chunk, metadata in graph.astream(graph_input, config=self.config, stream_mode="messages"):
+                        # Skip tokens from other nodes, e.g. the summary
+                        if metadata.get("langgraph_node") != "chat" or not chunk.content:
+                            continue
+                        if "time_to_first_token" not in self.last_metrics:
+                            self.last_metrics["time_to_first_token"] = time.perf_counter() - start_time
+                        yield chunk.content
+                else:
+                    response = await graph.ainvoke(graph_input, config=self.config)
+            if not stream:
+                yield response["messages"][-1].content
+            if self.deferred_summary:
+                await self._schedule_summary()
         except Exception as e:
             logging.error(f"Response generation failed: {str(e)}")
             raise
 
+        self.last_metrics["response_time"] = time.perf_counter() - start_time
+        recorder.record(
+            "turn", "response", self.last_metrics["response_time"],
+            thread_id=self.thread_id, start=started_at,
+            time_to_first_token=self.last_metrics.get("time_to_first_token"),
+        )
+        logging.info(
+            "Response generated: time to first token %.3fs, total %.3fs",
+            self.last_metrics.get("time_to_first_token", self.last_metrics["response_time"]),
+            self.last_metrics["response_time"],
+        )
+
+    def get_response(self, user_input, stream=True):
+        """Generate streaming response for user input, a blocking wrapper around aget_response"""
+        return _iterate_sync(self.aget_response(user_input, stream=stream))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assistant graph utilities")
+    parser.add_argument("--export-graph", metavar="PATH", nargs="?", const="graph.png", help="write the graph diagram as a PNG")
+    args = parser.parse_args()
+    if args.export_graph:
+        export_graph(args.export_graph)
+        print(f"Graph written to {args.export_graph}")
+    else:
+        parser.print_help()
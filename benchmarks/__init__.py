@@ -0,0 +1,15 @@
+"""Offline load tests and benchmarks with a fake model, run them from the repository root:
+
+    python -m benchmarks.concurrency
+    python -m benchmarks.suite --output results.json
+"""
+import statistics
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values, None when there are none"""
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
@@ -0,0 +1,108 @@
+"""Load test of concurrent conversations against a temporary database.
+
+Every conversation runs `--turns` turns through the assistant with a fake
+model that waits `--latency` seconds per call. "async" runs all of them on
+one event loop with aget_response. "blocking" calls get_response from a
+thread per conversation, the way Streamlit sessions do: the replies still
+run on the shared background loop, so it measures the cost of the blocking
+wrapper, not the synchronous engine that preceded the async one.
+
+    python -m benchmarks.concurrency --levels 1,4,16,64 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from assistant import Assistant
+from storage import Storage
+from benchmarks import percentile
+from benchmarks.fakes import FakeChatModel
+
+
+def _report(mode, concurrency, turns, latencies, elapsed):
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "turns": turns,
+        "elapsed": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2),
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+    }
+
+
+async def _run_async(storage, llm, concurrency, turns):
+    assistants = [Assistant(llm, thread_id=str(uuid.uuid4()), storage=storage) for _ in range(concurrency)]
+    latencies = []
+
+    async def conversation(assistant):
+        for turn in range(turns):
+            start = time.perf_counter()
+            async for _ in assistant.aget_response(f"message {turn}"):
+                pass
+            latencies.append(time.perf_counter() - start)
+        await assistant.await_background()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(a) for a in assistants))
+    return _report("async", concurrency, concurrency * turns, latencies, time.perf_counter() - start)
+
+
+def _run_blocking(storage, llm, concurrency, turns):
+    assistants = [Assistant(llm, thread_id=str(uuid.uuid4()), storage=storage) for _ in range(concurrency)]
+    latencies = []
+
+    def conversation(assistant):
+        for turn in range(turns):
+            start = time.perf_counter()
+            for _ in assistant.get_response(f"message {turn}"):
+                pass
+            latencies.append(time.perf_counter() - start)
+        assistant.wait_for_background()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(conversation, assistants))
+    return _report("blocking", concurrency, concurrency * turns, latencies, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how concurrent conversations scale")
+    parser.add_argument("--levels", default="1,4,16,64", help="comma separated numbers of concurrent conversations")
+    parser.add_argument("--turns", type=int, default=3, help="turns per conversation")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds the fake model takes per call")
+    parser.add_argument("--modes", default="async,blocking", help="comma separated: async, blocking")
+    parser.add_argument("--json", action="store_true", help="print one JSON report per line")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    llm = FakeChatModel(latency=args.latency)
+    modes = args.modes.split(",")
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "load.sqlite"))
+        try:
+            for level in (int(n) for n in args.levels.split(",")):
+                for mode in modes:
+                    if mode == "async":
+                        report = asyncio.run(_run_async(storage, llm, level, args.turns))
+                    else:
+                        report = _run_blocking(storage, llm, level, args.turns)
+                    if args.json:
+                        print(json.dumps(report))
+                    else:
+                        print(
+                            f"{report['mode']:>8} x{report['concurrency']:<4} "
+                            f"{report['turns_per_second']:8.2f} turns/s  "
+                            f"p50 {report['latency_p50']:.3f}s  p95 {report['latency_p95']:.3f}s"
+                        )
+        finally:
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
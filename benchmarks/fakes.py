@@ -0,0 +1,53 @@
+import asyncio
+import time
+import zlib
+from typing import List
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from transcript import content_text
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model that echoes the last message after a fixed delay"""
+
+    # Seconds before the first token, like a model's time to first token
+    latency: float = 0.0
+    # Seconds between streamed tokens
+    token_latency: float = 0.0
+    # Sentences replies are drawn from, replies echo the input when empty
+    corpus: List[str] = []
+    # Sentences per reply drawn from the corpus
+    reply_sentences: int = 4
+
+    @property
+    def _llm_type(self):
+        return "fake-echo"
+
+    def _reply(self, messages):
+        text = content_text(messages[-1].content) if messages else ""
+        if not self.corpus:
+            return f"You said: {text}"[:200]
+        # Seeded by the input so the same prompt always gets the same reply
+        seed = zlib.crc32(text.encode())
+        return " ".join(self.corpus[(seed + i * 7919) % len(self.corpus)] for i in range(self.reply_sentences))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
@@ -0,0 +1,125 @@
+"""Compare checkpoint serializers on a realistic corpus.
+
+Runs the same scripted conversations, built from the sentences of
+README.md, against one temporary database per serializer and reports the
+bytes written per checkpoint, the database size and the latency of
+loading each thread's latest checkpoint. It also checks that checkpoints
+written with the previous default load with CompactSerializer.
+
+    python -m benchmarks.serialization --threads 20 --turns 30
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from assistant import Assistant
+from storage import Storage
+from serialization import CompactSerializer
+from benchmarks.fakes import FakeChatModel
+
+
+# Timed loads of each thread's latest checkpoint
+READ_REPEATS = 5
+
+SERIALIZERS = {
+    "jsonplus": lambda: JsonPlusSerializer(),
+    "compact-none": lambda: CompactSerializer(compression="none"),
+    "compact-zlib": lambda: CompactSerializer(compression="zlib"),
+    "compact-zstd": lambda: CompactSerializer(compression="zstd"),
+}
+
+
+def load_corpus(path="README.md"):
+    """Split a text into sentences"""
+    with open(path) as f:
+        text = re.sub(r"[`#*\[\]()!|]", " ", f.read())
+    return [s.strip() for s in re.split(r"(?<=[.?!:])\s+|\n\s*\n", text) if len(s.split()) >= 4]
+
+
+def build(db_path, serde, corpus, threads, turns, seed=0):
+    """Run scripted conversations into a new database, returns (storage, thread ids)"""
+    storage = Storage(db_path, serde=serde)
+    llm = FakeChatModel(corpus=corpus)
+    rng = random.Random(seed)
+    thread_ids = []
+    for t in range(threads):
+        thread_id = f"thread-{t}"
+        assistant = Assistant(llm, thread_id=thread_id, storage=storage)
+        for _ in range(turns):
+            question = " ".join(rng.sample(corpus, rng.randint(1, 3)))
+            for _ in assistant.get_response(question):
+                pass
+            assistant.wait_for_background()
+        thread_ids.append(thread_id)
+    return storage, thread_ids
+
+
+def measure(storage, thread_ids):
+    cur = storage.conn.cursor()
+    checkpoints, checkpoint_bytes = cur.execute(
+        "SELECT COUNT(*), SUM(LENGTH(checkpoint)) FROM checkpoints"
+    ).fetchone()
+    write_bytes = cur.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+    cur.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+    page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+
+    timings = []
+    for thread_id in thread_ids:
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        for _ in range(READ_REPEATS):
+            start = time.perf_counter()
+            storage.saver.get_tuple(config)
+            timings.append(time.perf_counter() - start)
+    return {
+        "checkpoints": checkpoints,
+        "bytes_per_checkpoint": round(checkpoint_bytes / checkpoints, 1),
+        "bytes_per_write": round(write_bytes / max(cur.execute("SELECT COUNT(*) FROM writes").fetchone()[0], 1), 1),
+        "written_bytes": checkpoint_bytes + write_bytes,
+        "database_bytes": page_count * page_size,
+        "read_latency_median_ms": round(statistics.median(timings) * 1000, 3),
+    }
+
+
+def reads_legacy(db_path, thread_ids):
+    """Open a database written by JsonPlusSerializer with the default serializer"""
+    storage = Storage(db_path)
+    try:
+        return all(
+            storage.saver.get_tuple({"configurable": {"thread_id": t, "checkpoint_ns": ""}}) is not None
+            for t in thread_ids
+        )
+    finally:
+        storage.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare checkpoint serializers")
+    parser.add_argument("--threads", type=int, default=20, help="conversations per database")
+    parser.add_argument("--turns", type=int, default=30, help="turns per conversation")
+    parser.add_argument("--serializers", default=",".join(SERIALIZERS), help="comma separated: " + ", ".join(SERIALIZERS))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus = load_corpus()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.serializers.split(","):
+            db_path = os.path.join(tmp, f"{name}.sqlite")
+            storage, thread_ids = build(db_path, SERIALIZERS[name](), corpus, args.threads, args.turns)
+            try:
+                report = {"serializer": name, **measure(storage, thread_ids)}
+            finally:
+                storage.close()
+            if name == "jsonplus":
+                report["reads_with_compact"] = reads_legacy(db_path, thread_ids)
+            print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
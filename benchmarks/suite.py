@@ -0,0 +1,257 @@
+"""Offline benchmarks of the assistant and the GUI data paths.
+
+Drives Assistant with a deterministic fake model against a temporary
+database and measures, as the number of threads and the length of one
+thread grow:
+
+- per-turn latency of get_response
+- bytes written per checkpoint, and database growth per turn
+- first render of AssistantGUI._get_session_messages with a cold state cache
+- sidebar data loading, one catalog page plus the current thread
+
+Results are written as JSON, compare two runs with --compare:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json
+    python -m benchmarks.suite --compare before.json after.json
+
+The full ranges take a while:
+
+    python -m benchmarks.suite --threads 10,100,1000,10000 --turns 10,100,1000,5000
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from streamlit.logger import set_log_level
+from assistant import Assistant
+from gui import AssistantGUI, MESSAGE_PAGE_SIZE, SIDEBAR_PAGE_SIZE
+from storage import Storage
+from benchmarks import percentile
+from benchmarks.fakes import FakeChatModel
+
+
+# Timed repetitions of each read measurement, the median is reported
+READ_REPEATS = 5
+
+# Turns in each thread created for the thread count benchmark
+TURNS_PER_THREAD = 2
+
+
+def _median_time(fn, repeats=READ_REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Bench:
+    """A temporary database and the helpers that fill and measure it"""
+
+    def __init__(self, db_path, llm, memory_length):
+        self.db_path = db_path
+        self.llm = llm
+        self.memory_length = memory_length
+        self.storage = Storage(db_path)
+
+    def assistant(self, thread_id):
+        return Assistant(self.llm, thread_id=thread_id, memoryLenght=self.memory_length, storage=self.storage)
+
+    def turn(self, assistant, n):
+        """Run one turn and wait for its title and summary. Returns the reply's latency"""
+        start = time.perf_counter()
+        for _ in assistant.get_response(f"Message {n} about topic {n % 7}"):
+            pass
+        latency = time.perf_counter() - start
+        assistant.wait_for_background()
+        return latency
+
+    def written_bytes(self):
+        """Return (checkpoint count, bytes in checkpoints and writes)"""
+        cur = self.storage.reader.cursor()
+        count, checkpoint_bytes = cur.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+        ).fetchone()
+        write_bytes = cur.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+        return count, checkpoint_bytes + write_bytes
+
+    def file_bytes(self):
+        return sum(
+            os.path.getsize(path)
+            for path in (self.db_path, f"{self.db_path}-wal", f"{self.db_path}.vectors")
+            if os.path.exists(path)
+        )
+
+    def first_render(self, thread_id):
+        """Time _get_session_messages for a freshly opened thread, as after a click in the sidebar"""
+        def render():
+            gui = AssistantGUI(self.assistant(thread_id), self.storage)
+            gui._get_session_messages(thread_id, limit=MESSAGE_PAGE_SIZE)
+        return _median_time(render)
+
+    def sidebar_load(self, current_thread_id):
+        """Time the catalog reads behind one render of the sidebar"""
+        def load():
+            threads = self.storage.catalog.list_threads(limit=SIDEBAR_PAGE_SIZE + 1)
+            if current_thread_id not in [t["thread_id"] for t in threads[:SIDEBAR_PAGE_SIZE]]:
+                self.storage.catalog.get(current_thread_id)
+        return _median_time(load)
+
+    def segment(self, latencies, before, after, turns):
+        """Summarize the turns run between two (checkpoints, bytes, file bytes) readings"""
+        checkpoints = after[0] - before[0]
+        return {
+            "turn_latency_p50": percentile(latencies, 50),
+            "turn_latency_p95": percentile(latencies, 95),
+            "bytes_per_checkpoint": (after[1] - before[1]) / checkpoints if checkpoints else 0,
+            "file_bytes_per_turn": (after[2] - before[2]) / turns,
+        }
+
+    def reading(self):
+        return self.written_bytes() + (self.file_bytes(),)
+
+    def close(self):
+        self.storage.close()
+
+
+def bench_thread_count(bench, levels):
+    """Add threads of TURNS_PER_THREAD turns up to each level"""
+    results = []
+    thread_ids = []
+    for level in sorted(levels):
+        before = bench.reading()
+        latencies = []
+        while len(thread_ids) < level:
+            thread_id = str(uuid.uuid4())
+            assistant = bench.assistant(thread_id)
+            for n in range(TURNS_PER_THREAD):
+                latencies.append(bench.turn(assistant, n))
+            thread_ids.append(thread_id)
+        if not latencies:
+            continue
+        result = {"benchmark": "thread_count", "threads": level}
+        result.update(bench.segment(latencies, before, bench.reading(), len(latencies)))
+        # The oldest thread is the one furthest down the sidebar
+        result["first_render"] = bench.first_render(thread_ids[0])
+        result["sidebar_load"] = bench.sidebar_load(thread_ids[0])
+        results.append(result)
+        logging.info(f"Benchmark: {result}")
+    return results
+
+
+def bench_thread_length(bench, levels):
+    """Grow one thread turn by turn up to each level"""
+    results = []
+    thread_id = str(uuid.uuid4())
+    assistant = bench.assistant(thread_id)
+    turns = 0
+    for level in sorted(levels):
+        before = bench.reading()
+        latencies = []
+        while turns < level:
+            latencies.append(bench.turn(assistant, turns))
+            turns += 1
+        if not latencies:
+            continue
+        result = {"benchmark": "thread_length", "turns": level}
+        result.update(bench.segment(latencies, before, bench.reading(), len(latencies)))
+        result["first_render"] = bench.first_render(thread_id)
+        result["sidebar_load"] = bench.sidebar_load(thread_id)
+        results.append(result)
+        logging.info(f"Benchmark: {result}")
+    return results
+
+
+def run(thread_levels, turn_levels, latency=0.0, memory_length=10):
+    llm = FakeChatModel(latency=latency)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Separate databases so one benchmark's data doesn't skew the other
+        for name, levels, fn in (
+            ("threads", thread_levels, bench_thread_count),
+            ("turns", turn_levels, bench_thread_length),
+        ):
+            if not levels:
+                continue
+            bench = Bench(os.path.join(tmp, f"{name}.sqlite"), llm, memory_length)
+            try:
+                results.extend(fn(bench, levels))
+            finally:
+                bench.close()
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "params": {
+            "threads": thread_levels,
+            "turns": turn_levels,
+            "latency": latency,
+            "memory_length": memory_length,
+        },
+        "results": results,
+    }
+
+
+def compare(before, after):
+    """Print each metric of two runs side by side with the ratio after/before"""
+    def key(result):
+        return (result["benchmark"], result.get("threads", result.get("turns")))
+
+    previous = {key(r): r for r in before["results"]}
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for result in after["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            if metric in ("benchmark", "threads", "turns") or not old.get(metric):
+                continue
+            print(f"{key(result)[0]:>13} {key(result)[1]:>6} {metric:<20} {old[metric]:12.6g} {value:12.6g} {value / old[metric]:7.2f}x")
+
+
+def _levels(text):
+    return [int(n) for n in text.split(",") if n]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with a fake model")
+    parser.add_argument("--threads", default="10,100,1000", help="comma separated thread counts")
+    parser.add_argument("--turns", default="10,100,1000", help="comma separated lengths of one thread")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake model takes per call")
+    parser.add_argument("--memory-length", type=int, default=10, help="messages kept before summarizing")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    # The GUI helpers run outside a Streamlit script here
+    set_log_level("error")
+    report = run(_levels(args.threads), _levels(args.turns), args.latency, args.memory_length)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
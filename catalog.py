@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langchain_core.messages import HumanMessage
+from transcript import TranscriptStore
+from search import MessageSearch
+from retrieval import VectorIndex
+from serialization import CompactSerializer
+from metrics import recorder
+
+
+PREVIEW_LENGTH = 40
+
+
+def _preview(messages):
+    """Return a short preview of the first human message"""
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            content = msg.content if isinstance(msg.content, str) else str(msg.content)
+            return content[:PREVIEW_LENGTH] + "..." if len(content) > PREVIEW_LENGTH else content
+    return None
+
+
+class ThreadCatalog:
+    """One row per thread with the data the sidebar needs"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def setup(self, cur=None):
+        """Create the threads table. Returns True if it did not exist yet"""
+        cur = cur or self.conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='threads'")
+        created = cur.fetchone() is None
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                title TEXT,
+                preview TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at DESC);
+            """
+        )
+        return created
+
+    def upsert(self, cur, thread_id, values, ts, archived_count=0):
+        """Record the latest state of a thread from a checkpoint's channel values"""
+        messages = values.get("messages") or []
+        # Legacy checkpoints still carry archived messages in full_history
+        full_history = values.get("full_history") or []
+        # Keep the first preview once set: early messages get pruned by summarization
+        preview = _preview(full_history) or _preview(messages)
+        cur.execute(
+            """
+            INSERT INTO threads (thread_id, title, preview, message_count, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(thread_id) DO UPDATE SET
+                title = COALESCE(NULLIF(excluded.title, ''), threads.title),
+                preview = COALESCE(threads.preview, excluded.preview),
+                message_count = excluded.message_count,
+                updated_at = excluded.updated_at
+            """,
+            (
+                str(thread_id),
+                values.get("title") or None,
+                preview,
+                len(messages) + archived_count,
+                ts,
+                ts,
+            ),
+        )
+
+    def get(self, thread_id):
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT thread_id, title, preview, message_count, created_at, updated_at FROM threads WHERE thread_id = ?",
+            (str(thread_id),),
+        )
+        row = cur.fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_threads(self, limit=50, offset=0):
+        """Return one page of threads, most recently updated first"""
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT thread_id, title, preview, message_count, created_at, updated_at FROM threads ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [self._row_to_dict(row) for row in cur.fetchall()]
+
+    def delete(self, thread_id, cur=None):
+        cur = cur or self.conn.cursor()
+        cur.execute("DELETE FROM threads WHERE thread_id = ?", (str(thread_id),))
+
+    @staticmethod
+    def _row_to_dict(row):
+        thread_id, title, preview, message_count, created_at, updated_at = row
+        return {
+            "thread_id": thread_id,
+            "title": title,
+            "preview": preview,
+            "message_count": message_count,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+
+def _vectors_path(conn):
+    """Path of the vector file next to the connection's database file"""
+    path = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+    return f"{path or ':memory:'}.vectors"
+
+
+class CatalogSqliteSaver(SqliteSaver):
+    """SqliteSaver that keeps the thread catalog in sync with every checkpoint write
+    and owns the transcript of archived messages and their retrieval index"""
+
+    def __init__(self, conn, serde=None, **kwargs):
+        # Compressed checkpoints by default, older uncompressed ones still load
+        super().__init__(conn, serde=serde or CompactSerializer(), **kwargs)
+        self.catalog = ThreadCatalog(conn)
+        self.transcript = TranscriptStore(conn)
+        self.search = MessageSearch(conn)
+        # Retrieval index over archived messages, vectors live next to the database
+        self.vectors = VectorIndex(self, conn, _vectors_path(conn))
+        # Stores with per-thread rows, cleared by delete_thread
+        self.thread_stores = [self.catalog, self.transcript, self.search, self.vectors]
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        cur = self.conn.cursor()
+        try:
+            # One-time move of full_history out of state when the transcript is new
+            if self.transcript.setup(cur):
+                self.transcript.migrate_full_history(cur, self.latest_checkpoints(cur))
+            # One-time catalog of threads checkpointed before it existed
+            if self.catalog.setup(cur):
+                self._backfill_catalog(cur)
+            if self.search.setup(cur):
+                self.search.rebuild(cur, self.latest_checkpoints(cur))
+            if self.vectors.setup(cur):
+                self.vectors.backfill(cur, self.transcript)
+            self.conn.commit()
+        finally:
+            cur.close()
+
+    def latest_checkpoints(self, cur):
+        """Yield (thread_id, checkpoint) for the latest top-level checkpoint of every thread"""
+        cur.execute(
+            """
+            SELECT c.thread_id, c.type, c.checkpoint
+            FROM checkpoints c
+            JOIN (
+                SELECT thread_id, MAX(checkpoint_id) AS checkpoint_id
+                FROM checkpoints
+                WHERE checkpoint_ns = ''
+                GROUP BY thread_id
+            ) latest ON c.thread_id = latest.thread_id AND c.checkpoint_id = latest.checkpoint_id
+            WHERE c.checkpoint_ns = ''
+            """
+        )
+        # Fetched up front so callers can write through the same cursor
+        for thread_id, type_, blob in cur.fetchall():
+            try:
+                checkpoint = self.serde.loads_typed((type_, blob))
+            except Exception:
+                logging.exception(f"Error loading the latest checkpoint of {thread_id}")
+                continue
+            yield thread_id, checkpoint
+
+    def _backfill_catalog(self, cur):
+        """Add catalog rows for threads checkpointed before the catalog existed"""
+        for thread_id, checkpoint in self.latest_checkpoints(cur):
+            self.catalog.upsert(
+                cur,
+                thread_id,
+                checkpoint.get("channel_values", {}),
+                checkpoint["ts"],
+                self.transcript.count(thread_id, cur),
+            )
+
+    def archive_messages(self, thread_id, messages):
+        """Append messages pruned from a thread's state to its transcript"""
+        with self.cursor() as cur:
+            self.transcript.append(cur, thread_id, messages)
+
+    def get_latest_checkpoint_id(self, thread_id):
+        """Return the id of a thread's latest checkpoint without loading it"""
+        with self.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' ORDER BY checkpoint_id DESC LIMIT 1",
+                (str(thread_id),),
+            )
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def rebuild_search(self):
+        """Reindex every thread's messages for search"""
+        with self.cursor() as cur:
+            self.search.rebuild(cur, self.latest_checkpoints(cur))
+
+    def index_checkpoint(self, config, checkpoint):
+        """Refresh the thread's catalog row and index its new messages from a checkpoint just written"""
+        values = checkpoint.get("channel_values", {})
+        # Subgraph checkpoints and bare input checkpoints don't describe the thread
+        if not config["configurable"].get("checkpoint_ns") and ("messages" in values or "title" in values):
+            thread_id = config["configurable"]["thread_id"]
+            with recorder.timed("storage", "index_checkpoint", thread_id), self.cursor() as cur:
+                self.catalog.upsert(cur, thread_id, values, checkpoint["ts"], self.transcript.count(thread_id, cur))
+                self.search.add(cur, thread_id, values.get("messages") or [])
+
+    def get_tuple(self, config):
+        with recorder.timed("storage", "checkpoint_read", config["configurable"].get("thread_id")):
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with recorder.timed("storage", "checkpoint_write", config["configurable"]["thread_id"]):
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+        self.index_checkpoint(config, checkpoint)
+        return next_config
+
+    def delete_thread(self, thread_id):
+        """Delete a thread's checkpoints, writes and rows in every thread store in one transaction"""
+        with self.cursor() as cur:
+            try:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (str(thread_id),))
+                cur.execute("DELETE FROM writes WHERE thread_id = ?", (str(thread_id),))
+                for store in self.thread_stores:
+                    store.delete(thread_id, cur)
+            except Exception:
+                self.conn.rollback()
+                raise
+
+
+class AsyncCatalogSqliteSaver(AsyncSqliteSaver):
+    """AsyncSqliteSaver for graphs run with ainvoke/astream.
+
+    Checkpoints are written through its aiosqlite connection, the catalog and
+    the other thread stores stay with the sync saver, which it hands the
+    catalog and search updates to after each write.
+    """
+
+    def __init__(self, conn, sync_saver):
+        super().__init__(conn, serde=sync_saver.serde)
+        self.sync_saver = sync_saver
+
+    async def aget_latest_checkpoint_id(self, thread_id):
+        """Return the id of a thread's latest checkpoint without loading it"""
+        async with self.lock, self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' ORDER BY checkpoint_id DESC LIMIT 1",
+            (str(thread_id),),
+        ) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def _checkpoint_bytes(self, config):
+        """Return the stored size of a checkpoint and its metadata"""
+        configurable = config["configurable"]
+        async with self.lock, self.conn.execute(
+            "SELECT LENGTH(checkpoint) + LENGTH(metadata) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (str(configurable["thread_id"]), configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"]),
+        ) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else 0
+
+    async def aget_tuple(self, config):
+        with recorder.timed("storage", "checkpoint_read", config["configurable"].get("thread_id")):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        start = time.perf_counter()
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        duration = time.perf_counter() - start
+        # Sized after the write so the lookup isn't counted in its time
+        recorder.record(
+            "storage", "checkpoint_write", duration,
+            thread_id=config["configurable"]["thread_id"],
+            bytes=await self._checkpoint_bytes(next_config),
+        )
+        await asyncio.to_thread(self.sync_saver.index_checkpoint, config, checkpoint)
+        return next_config
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.sync_saver.delete_thread, thread_id)
@@ -1,15 +1,33 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import logging
 from assistant import Assistant
-from langgraph.checkpoint.sqlite import SqliteSaver
+from metrics import recorder
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 import uuid
 
+# Number of threads shown in the sidebar before "Load more"
+SIDEBAR_PAGE_SIZE = 50
+
+# Number of messages rendered per page of the transcript
+MESSAGE_PAGE_SIZE = 50
+
+def _rerun_fragment():
+    """Rerun only the calling fragment, or the app when it is running as part of a full run"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
 class AssistantGUI:
-    def __init__(self, assistant, conn):
+    def __init__(self, assistant, storage, debug_panel=False):
         self.assistant = assistant
-        self.conn = conn
-        self.saver = SqliteSaver(self.conn)
+        self.storage = storage
+        # Show the performance panel in the sidebar
+        self.debug_panel = debug_panel
+        self.saver = storage.saver
+        self.catalog = storage.catalog
         self._update_state_from_assistant()
 
     def _update_state_from_assistant(self):
@@ -18,35 +36,24 @@ class AssistantGUI:
             "id": self.assistant.thread_id,
         }
 
-    def _get_session_messages(self, thread_id: str) -> list:
-        """Retrieve full message history from checkpoints"""
-        
-        # Use the LangGraph API to get checkpoint history
-        config = {"configurable": {"thread_id": thread_id}}
+    def _get_session_messages(self, thread_id: str, limit: int = None) -> list:
+        """Retrieve message history from checkpoints, only the last `limit` messages if given"""
         
         try:
-            # Get the state history for this thread
-            checkpoints = list(self.assistant.graph.get_state_history(config))
-            
+            # Load only the latest checkpoint for this thread
+            latest_checkpoint = self.assistant.get_latest_state(thread_id)
             
-            if not checkpoints:
+            if latest_checkpoint is None:
                 return []
             
-            # The latest checkpoint should have all messages
-            latest_checkpoint = checkpoints[0]  # First one is the most recent
-            
-            # Combine full_history with current messages
-            result = []
-            
-            # First add the full history if it exists
-            if "full_history" in latest_checkpoint.values:
-                full_history = latest_checkpoint.values["full_history"]
-                result.extend(full_history)
+            messages = latest_checkpoint.values.get("messages", [])
+            if limit is not None and len(messages) >= limit:
+                return messages[-limit:]
             
-            # Then add current messages
-            if "messages" in latest_checkpoint.values:
-                messages = latest_checkpoint.values["messages"]
-                result.extend(messages)
+            # Archived messages come first, then the ones still in state
+            archived_limit = None if limit is None else limit - len(messages)
+            result = self.storage.transcript.read(thread_id, limit=archived_limit)
+            result.extend(messages)
                 
             return result
             
@@ -56,162 +63,233 @@ class AssistantGUI:
             traceback.print_exc()
             return []
 
+    def _open_thread(self, thread_id):
+        """Switch the session to another thread and rerun"""
+        st.session_state.assistant = Assistant(
+            llm=st.session_state.llm,
+            thread_id=thread_id,
+            storage=self.storage
+        )
+        
+        # Update GUI state
+        self.assistant = st.session_state.assistant
+        self._update_state_from_assistant()
+        
+        # Force a rerun to refresh the UI
+        st.rerun()
+
+    @staticmethod
+    def _thread_label(thread):
+        """Sidebar label of a catalog entry: its title, then its first message preview"""
+        return thread.get("title") or thread.get("preview") or "New chat"
+
+    def render_search_results(self, query):
+        """List the best matching message of each thread, a click opens the thread"""
+        results = self.storage.search.search(query)
+        if not results:
+            st.info("No matching chats")
+            return
+        for result in results:
+            if st.button(result["title"] or "New chat", key=f"search_{result['thread_id']}", use_container_width=True):
+                self._open_thread(result["thread_id"])
+            st.caption(result["snippet"])
+
+    @st.fragment
     def render_sidebar(self):
-        with st.sidebar:
-            # Fixed header section
-            fixed_header = st.container()
-            with fixed_header:
-                st.header("Chat Sessions")
-                
-                # Create New Chat button - full width
-                if st.button("New Chat", key="new_chat", use_container_width=True):
-                    # Generate a new thread ID
-                    new_thread_id = str(uuid.uuid4())
-                    
-                    # Create a new assistant with this thread ID
-                    st.session_state.assistant = Assistant(
-                        llm=st.session_state.llm,
-                        thread_id=new_thread_id
-                    )
-                    
-                    # Update GUI state
-                    self.assistant = st.session_state.assistant
-                    self._update_state_from_assistant()
-                    
-                    # Store current session in session state
-                    st.session_state.current_session = {
-                        "id": new_thread_id,
-                    }
-                    
-                    # Force a rerun to refresh the UI
-                    st.rerun()
-                
-                st.divider()
+        """Thread list and search, rerun on their own when used"""
+        with recorder.timed("render", "sidebar", self.assistant.thread_id):
+            self._sidebar()
+
+    def _sidebar(self):
+        # Fixed header section
+        fixed_header = st.container()
+        with fixed_header:
+            st.header("Chat Sessions")
             
-            # Get all unique thread IDs from the database
-            try:
-                cur = self.conn.cursor()
+            # Create New Chat button - full width
+            if st.button("New Chat", key="new_chat", use_container_width=True):
+                # Generate a new thread ID
+                new_thread_id = str(uuid.uuid4())
                 
-                # Check if the checkpoints table exists
-                cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints'")
-                table_exists = cur.fetchone()
+                # Create a new assistant with this thread ID
+                st.session_state.assistant = Assistant(
+                    llm=st.session_state.llm,
+                    thread_id=new_thread_id,
+                    storage=self.storage
+                )
                 
-                if not table_exists:
-                    # Table doesn't exist, display info message and return
-                    st.info("No previous chats found")
-                    return
+                # Update GUI state
+                self.assistant = st.session_state.assistant
+                self._update_state_from_assistant()
                 
-                # Get thread_id and order by most recent
-                cur.execute("SELECT thread_id, MAX(ROWID) FROM checkpoints GROUP BY thread_id ORDER BY MAX(ROWID) DESC")
-                thread_data = cur.fetchall()
+                # Store current session in session state
+                st.session_state.current_session = {
+                    "id": new_thread_id,
+                }
                 
-                # Current thread ID
-                current_thread_id = self.assistant.thread_id
-                
-                # Create a list of all thread IDs to display
-                all_thread_ids = []
-                
-                # Add current thread ID first if it's not in the database yet
-                if current_thread_id not in [t[0] for t in thread_data]:
-                    all_thread_ids.append((current_thread_id, None))
-                
-                # Add all thread IDs from the database
-                all_thread_ids.extend(thread_data)
-                
-                if not all_thread_ids:
-                    st.info("No previous chats found")
-                else:
-                    # Display all chats in a clean list
-                    for thread_id, _ in all_thread_ids:
-                  
-                        
-                        # Default preview
-                        preview = "New chat"
-                        
-                        # For threads in the database, get title from state
-                        if thread_id in [t[0] for t in thread_data]:
-                            # Get the state for this thread
-                            config = {"configurable": {"thread_id": thread_id}}
+                # Force a rerun to refresh the UI
+                st.rerun()
+            
+            st.divider()
+        
+        # Search every conversation instead of listing them
+        query = st.text_input("Search chats", key="thread_search", placeholder="Search chats", label_visibility="collapsed")
+        if query.strip():
+            # The current thread's entry is not shown, nothing to keep up to date
+            st.session_state.sidebar_entry = None
+            self.render_search_results(query)
+            return
+        
+        # Load one page of threads from the catalog, most recent first
+        try:
+            page_size = st.session_state.get("sidebar_page_size", SIDEBAR_PAGE_SIZE)
+            # Fetch one extra row to know whether there is another page
+            threads = self.catalog.list_threads(limit=page_size + 1)
+            has_more = len(threads) > page_size
+            threads = threads[:page_size]
+            
+            # Current thread ID
+            current_thread_id = self.assistant.thread_id
+            
+            # Add current thread first if it's not on this page
+            if current_thread_id not in [t["thread_id"] for t in threads]:
+                threads.insert(0, self.catalog.get(current_thread_id) or {"thread_id": current_thread_id})
+            
+            if not threads:
+                st.info("No previous chats found")
+            else:
+                # Display all chats in a clean list
+                for thread in threads:
+                    thread_id = thread["thread_id"]
+                    
+                    # Prefer the title, then the first message preview
+                    preview = self._thread_label(thread)
+                    if thread_id == current_thread_id:
+                        # Remembered so a reply only reruns the app when this entry changes
+                        st.session_state.sidebar_entry = (thread_id, preview)
+                    
+                    # Create a row with chat button and delete button
+                    col1, col2 = st.columns([5, 1])
+                    
+                    # Chat button in first column
+                    with col1:
+                        if st.button(f"{preview}", 
+                                    key=f"chat_{thread_id}", 
+                                    use_container_width=True):
+                            # Switch to this thread
+                            self._open_thread(thread_id)
+                    
+                    # Delete button in second column
+                    with col2:
+                        if st.button("🗑️", key=f"delete_{thread_id}"):
+                            # Delete this thread from the database
                             try:
-                                checkpoints = list(self.assistant.graph.get_state_history(config))
-                                if checkpoints:
-                                    # Try to get the title from state
-                                    if "title" in checkpoints[0].values and checkpoints[0].values["title"]:
-                                        preview = checkpoints[0].values["title"]
-                                    else:
-                                        # Fallback to first message preview
-                                        messages = []
-                                        if "messages" in checkpoints[0].values:
-                                            messages = checkpoints[0].values["messages"]
-                                        elif "full_history" in checkpoints[0].values:
-                                            messages = checkpoints[0].values["full_history"]
-                                        
-                                        # Find first human message for preview
-                                        for msg in messages:
-                                            if isinstance(msg, HumanMessage):
-                                                preview = msg.content[:40] + "..." if len(msg.content) > 40 else msg.content
-                                                break
-                            except Exception as e:
-                                print(f"Error loading chat preview: {str(e)}")
-                        
-                        # Create a row with chat button and delete button
-                        col1, col2 = st.columns([5, 1])
-                        
-                        # Chat button in first column
-                        with col1:
-                            if st.button(f"{preview}", 
-                                        key=f"chat_{thread_id}", 
-                                        use_container_width=True):
-                                # Switch to this thread
-                                st.session_state.assistant = Assistant(
-                                    llm=st.session_state.llm,
-                                    thread_id=thread_id
-                                )
+                                # Delete all checkpoints, writes and transcript rows for this thread,
+                                # after any background title or summary write in flight
+                                self.assistant.delete_thread(thread_id)
                                 
-                                # Update GUI state
-                                self.assistant = st.session_state.assistant
-                                self._update_state_from_assistant()
-                                
-                                # Force a rerun to refresh the UI
-                                st.rerun()
-                        
-                        # Delete button in second column
-                        with col2:
-                            if st.button("🗑️", key=f"delete_{thread_id}"):
-                                # Delete this thread from the database
-                                try:
-                                    # Delete all checkpoints for this thread
-                                    cur.execute("DELETE FROM checkpoints WHERE thread_id=?", (thread_id,))
-                                    self.conn.commit()
+                                # If we deleted the current thread, create a new one
+                                if thread_id == current_thread_id:
+                                    # Generate a new thread ID
+                                    new_thread_id = str(uuid.uuid4())
+                                    
+                                    # Create a new assistant with this thread ID
+                                    st.session_state.assistant = Assistant(
+                                        llm=st.session_state.llm,
+                                        thread_id=new_thread_id,
+                                        storage=self.storage
+                                    )
                                     
-                                    # If we deleted the current thread, create a new one
-                                    if thread_id == current_thread_id:
-                                        # Generate a new thread ID
-                                        new_thread_id = str(uuid.uuid4())
-                                        
-                                        # Create a new assistant with this thread ID
-                                        st.session_state.assistant = Assistant(
-                                            llm=st.session_state.llm,
-                                            thread_id=new_thread_id
-                                        )
-                                        
-                                        # Update GUI state
-                                        self.assistant = st.session_state.assistant
-                                        self._update_state_from_assistant()
+                                    # Update GUI state
+                                    self.assistant = st.session_state.assistant
+                                    self._update_state_from_assistant()
                                     
-                                    # Force a rerun to refresh the UI
+                                    # The transcript changes too, rerun the whole app
                                     st.rerun()
-                                except Exception as e:
-                                    st.error(f"Error deleting chat: {str(e)}")
-                                    print(f"ERROR deleting chat: {str(e)}")
-                        
-                   
-            except Exception as e:
-                # Handle the error gracefully
-                st.info("No previous chats found")
+                                
+                                # Only the list changed
+                                _rerun_fragment()
+                            except Exception as e:
+                                st.error(f"Error deleting chat: {str(e)}")
+                                print(f"ERROR deleting chat: {str(e)}")
+                
+                # Load the next page on demand
+                if has_more and st.button("Load more", key="load_more_threads", use_container_width=True):
+                    st.session_state.sidebar_page_size = page_size + SIDEBAR_PAGE_SIZE
+                    _rerun_fragment()
+               
+        except Exception as e:
+            # Handle the error gracefully
+            st.info("No previous chats found")
+
+    @st.fragment
+    def render_debug_panel(self):
+        """Show where the current thread's last turn spent its time and how often each part reran"""
+        with st.expander("Performance"):
+            # The panel is a fragment of its own, refresh it after a turn
+            st.button("Refresh", key="refresh_debug_panel")
+            events = recorder.last_turn(self.assistant.thread_id)
+            if not events:
+                st.caption("No turns recorded yet")
+            else:
+                turn_start = events[0]["start"]
+                st.dataframe(
+                    [
+                        {
+                            "at (ms)": round((e["start"] - turn_start) * 1000, 1),
+                            "kind": e["kind"],
+                            "name": e["name"],
+                            "time (ms)": round(e["duration"] * 1000, 1),
+                            "tokens in": e.get("input_tokens"),
+                            "tokens out": e.get("output_tokens"),
+                            "bytes": e.get("bytes"),
+                        }
+                        for e in events
+                    ],
+                    hide_index=True,
+                )
+            renders = self._render_stats(self.assistant.thread_id)
+            if renders:
+                st.caption("Reruns")
+                st.dataframe(renders, hide_index=True)
+            st.download_button("Export JSON lines", recorder.to_jsonl(), file_name="metrics.jsonl", mime="application/jsonl")
+            st.download_button("Export Prometheus", recorder.to_prometheus(), file_name="metrics.prom", mime="text/plain")
 
+    @staticmethod
+    def _render_stats(thread_id):
+        """Runs and render times of the app and each fragment, from the buffered render events"""
+        stats = {}
+        for e in recorder.recent(thread_id):
+            if e["kind"] == "render":
+                stats.setdefault(e["name"], []).append(e["duration"] * 1000)
+        return [
+            {
+                "part": name,
+                "runs": len(times),
+                "last (ms)": round(times[-1], 1),
+                "mean (ms)": round(sum(times) / len(times), 1),
+            }
+            for name, times in stats.items()
+        ]
+
+    def _live_messages(self):
+        """Messages sent in this thread since the transcript was last rendered"""
+        live = st.session_state.get("live_messages")
+        if not live or live["thread_id"] != self.assistant.thread_id:
+            return []
+        return live["messages"]
+
+    @st.fragment
     def handle_user_input(self):
-        user_input = st.chat_input("Type here...", key="input")
+        """Chat input, reruns alone on submit and shows the turns sent since the last full render"""
+        with st.bottom:
+            user_input = st.chat_input("Type here...", key="input")
+        
+        # The transcript fragment does not rerun on a reply, earlier replies are redrawn here
+        live = self._live_messages()
+        with recorder.timed("render", "input", self.assistant.thread_id):
+            self._display(live)
+        
         if user_input and user_input.strip() != "":
             # Display user message immediately
             with st.chat_message("human"):
@@ -231,12 +309,16 @@ class AssistantGUI:
                         response_container.markdown(full_response + "▌")
                     response_container.markdown(full_response)
                 
-                # Check if this was the first message (title might have been generated)
-                config = {"configurable": {"thread_id": self.assistant.thread_id}}
-                checkpoints = list(self.assistant.graph.get_state_history(config))
+                live = live + [HumanMessage(content=user_input), AIMessage(content=full_response)]
+                st.session_state.live_messages = {"thread_id": self.assistant.thread_id, "messages": live}
                 
-                # If we have a title now, force a rerun to update the sidebar
-                if checkpoints and checkpoints[0].values.get("title"):
+                # Rerun the whole app only when the thread's sidebar entry changed, e.g. its title
+                # landed, or to fold a long run of replies back into the paged transcript
+                entry = self.catalog.get(self.assistant.thread_id) or {}
+                shown = st.session_state.get("sidebar_entry")
+                if shown is not None and shown != (self.assistant.thread_id, self._thread_label(entry)):
+                    st.rerun()
+                if len(live) >= MESSAGE_PAGE_SIZE:
                     st.rerun()
 
             except Exception as e:
@@ -249,10 +331,29 @@ class AssistantGUI:
     def set_state(self, key, value):
         st.session_state[key] = value
 
+    @st.fragment
     def display_messages(self):
-        """Display all messages from checkpoint history"""
-        messages = self._get_session_messages(self.assistant.thread_id)
-        
+        """Display the latest page of messages, with older pages loaded on demand"""
+        thread_id = self.assistant.thread_id
+        with recorder.timed("render", "transcript", thread_id):
+            limits = st.session_state.setdefault("message_limits", {})
+            limit = limits.get(thread_id, MESSAGE_PAGE_SIZE)
+            
+            # Messages sent since the last full render are shown by the input fragment
+            live_count = len(self._live_messages())
+            
+            # Fetch one extra message to know whether there are earlier ones
+            messages = self._get_session_messages(thread_id, limit=limit + 1 + live_count)
+            messages = messages[:len(messages) - live_count]
+            if len(messages) > limit:
+                messages = messages[-limit:]
+                if st.button("Load earlier messages", key=f"load_earlier_{thread_id}"):
+                    limits[thread_id] = limit + MESSAGE_PAGE_SIZE
+                    _rerun_fragment()
+            
+            self._display(messages)
+
+    def _display(self, messages):
         for msg in messages:
             if isinstance(msg, HumanMessage):
                 with st.chat_message("human"):
@@ -265,7 +366,14 @@ class AssistantGUI:
                     st.markdown(msg.content)
 
     def render(self):
-        self.render_sidebar()
-        self.display_messages()
-        self.handle_user_input()
+        """Full app run. The sidebar, transcript and input are fragments that also rerun on their own"""
+        with recorder.timed("render", "app", self.assistant.thread_id):
+            # A full run renders the transcript from storage, replies included
+            st.session_state.live_messages = None
+            with st.sidebar:
+                self.render_sidebar()
+                if self.debug_panel:
+                    self.render_debug_panel()
+            self.display_messages()
+            self.handle_user_input()
       
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from langchain_core.messages import message_to_dict, messages_from_dict
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Seconds a cached response stays valid, override with LLM_CACHE_TTL
+DEFAULT_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Least recently used responses are evicted past this many entries
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+class LLMCache:
+    """SQLite-backed cache of LLM responses keyed by model, parameters and prompt.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted past `max_entries`. Hits and misses are counted per call site.
+    """
+
+    def __init__(self, saver, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.saver = saver
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def setup(self, cur):
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used);
+            """
+        )
+
+    @staticmethod
+    def key(llm, messages, **params):
+        """Hash the model with its parameters and the prompt, message ids are left out"""
+        prompt = [[m.type, m.content] for m in messages]
+        payload = json.dumps([llm._get_llm_string(**params), prompt], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _count(self, site, hit):
+        with self._stats_lock:
+            counters = self._stats.setdefault(site, {"hits": 0, "misses": 0})
+            counters["hits" if hit else "misses"] += 1
+
+    def get(self, key, site=None):
+        """Return the cached response message, or None if missing or expired"""
+        now = time.time()
+        with self.saver.cursor() as cur:
+            cur.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,))
+            row = cur.fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                cur.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            elif row is not None:
+                cur.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        self._count(site, row is not None)
+        if row is None:
+            return None
+        message = messages_from_dict([json.loads(row[0])])[0]
+        # Let the graph give the reused message a fresh id
+        message.id = None
+        return message
+
+    def put(self, key, message):
+        """Store a response and evict the least recently used entries past max_entries"""
+        now = time.time()
+        with self.saver.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(message_to_dict(message)), now, now),
+            )
+            cur.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_used
+                    LIMIT MAX((SELECT COUNT(*) FROM llm_cache) - ?, 0)
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def purge_expired(self):
+        """Delete expired entries, returns how many were removed"""
+        with self.saver.cursor() as cur:
+            cur.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            return cur.rowcount
+
+    def stats(self):
+        """Return hit and miss counters per call site since the process started"""
+        with self._stats_lock:
+            return {site: dict(counters) for site, counters in self._stats.items()}
@@ -0,0 +1,246 @@
+"""Checkpoint retention and compaction.
+
+Run it from the command line:
+
+    python maintenance.py --db checkpoints.sqlite --keep 5
+"""
+import argparse
+import json
+import logging
+import threading
+from catalog import CatalogSqliteSaver
+from llm_cache import LLMCache
+from storage import connect, DEFAULT_DB_PATH
+
+
+# Number of checkpoints kept per thread by default
+DEFAULT_KEEP = 5
+
+# Pages released per incremental vacuum step, None releases all free pages
+DEFAULT_VACUUM_PAGES = None
+
+# Pages released per run of the in-app job, bounded so it never holds the write lock for long
+BACKGROUND_VACUUM_PAGES = 1000
+
+# Rows of the writes table checked per transaction by the in-app job
+BACKGROUND_BATCH_SIZE = 1000
+
+
+class RetentionEngine:
+    """Prunes old checkpoints and orphaned writes and gives the space back to the OS"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.saver = CatalogSqliteSaver(conn)
+        self.saver.setup()
+        self.llm_cache = LLMCache(self.saver)
+        with self.saver.cursor() as cur:
+            self.llm_cache.setup(cur)
+
+    def _database_bytes(self):
+        """Size of the database pages plus the retrieval vector file"""
+        cur = self.conn.cursor()
+        page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+        page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size + self.saver.vectors.file_bytes()
+
+    def prune_checkpoints(self, keep=DEFAULT_KEEP, batched=False):
+        """Delete all but the latest `keep` checkpoints of every thread.
+
+        When batched, each thread is pruned in its own transaction so app writes never wait long.
+        """
+        if keep < 1:
+            raise ValueError("keep must be at least 1, the latest checkpoint holds the thread state")
+        if batched:
+            return self._prune_per_thread(keep)
+        with self.saver.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM checkpoints
+                WHERE (thread_id, checkpoint_ns, checkpoint_id) IN (
+                    SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+                        SELECT thread_id, checkpoint_ns, checkpoint_id,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY thread_id, checkpoint_ns
+                                ORDER BY checkpoint_id DESC
+                            ) AS position
+                        FROM checkpoints
+                    )
+                    WHERE position > ?
+                )
+                """,
+                (keep,),
+            )
+            return cur.rowcount
+
+    def _prune_per_thread(self, keep):
+        # Found outside any write transaction, readers don't block writers in WAL mode
+        with self.saver.cursor(transaction=False) as cur:
+            cur.execute(
+                "SELECT thread_id, checkpoint_ns FROM checkpoints GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > ?",
+                (keep,),
+            )
+            threads = cur.fetchall()
+        deleted = 0
+        for thread_id, checkpoint_ns in threads:
+            with self.saver.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                        SELECT checkpoint_id FROM checkpoints
+                        WHERE thread_id = ? AND checkpoint_ns = ?
+                        ORDER BY checkpoint_id DESC
+                        LIMIT ?
+                    )
+                    """,
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, keep),
+                )
+                deleted += cur.rowcount
+        return deleted
+
+    def delete_orphaned_writes(self, batch_size=None):
+        """Delete pending writes whose checkpoint no longer exists.
+
+        With a batch_size, writes are checked that many rows per transaction.
+        """
+        orphaned = """
+            NOT EXISTS (
+                SELECT 1 FROM checkpoints c
+                WHERE c.thread_id = writes.thread_id
+                    AND c.checkpoint_ns = writes.checkpoint_ns
+                    AND c.checkpoint_id = writes.checkpoint_id
+            )
+        """
+        if batch_size is None:
+            with self.saver.cursor() as cur:
+                cur.execute(f"DELETE FROM writes WHERE {orphaned}")
+                return cur.rowcount
+
+        deleted = 0
+        last_rowid = 0
+        while True:
+            with self.saver.cursor() as cur:
+                # Walk the table in rowid ranges so every batch is a bounded index range
+                cur.execute(
+                    "SELECT MAX(rowid) FROM (SELECT rowid FROM writes WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                    (last_rowid, batch_size),
+                )
+                next_rowid = cur.fetchone()[0]
+                if next_rowid is None:
+                    return deleted
+                cur.execute(
+                    f"DELETE FROM writes WHERE rowid > ? AND rowid <= ? AND {orphaned}",
+                    (last_rowid, next_rowid),
+                )
+                deleted += cur.rowcount
+            last_rowid = next_rowid
+
+    def delete_thread(self, thread_id):
+        """Delete a thread from every table in one transaction"""
+        self.saver.delete_thread(thread_id)
+
+    def vacuum(self, pages=DEFAULT_VACUUM_PAGES, full=True):
+        """Release free pages to the OS with incremental vacuum.
+
+        With full=False, as in the app's background job, a database created
+        before incremental auto_vacuum is left for the CLI to convert and the
+        WAL is only checkpointed passively, so app writes don't time out.
+        """
+        self.conn.commit()
+        cur = self.conn.cursor()
+        # auto_vacuum only takes effect after one full VACUUM
+        if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not full:
+                logging.info("Skipping vacuum, run maintenance.py once to enable incremental auto_vacuum")
+                return
+            logging.info("Enabling incremental auto_vacuum, running a full VACUUM once")
+            cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cur.execute("VACUUM")
+        elif pages is None:
+            cur.execute("PRAGMA incremental_vacuum").fetchall()
+        else:
+            cur.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        # Fold the WAL back into the database file so the file itself shrinks
+        mode = "TRUNCATE" if full else "PASSIVE"
+        cur.execute(f"PRAGMA wal_checkpoint({mode})").fetchall()
+
+    def run(self, keep=DEFAULT_KEEP, vacuum=True, vacuum_pages=DEFAULT_VACUUM_PAGES, compact_vectors=False, background=False):
+        """Run a full maintenance pass and return a report of what was reclaimed.
+
+        In the background, next to a running app, deletes go in small transactions
+        and there is no full VACUUM, so app writes never hit the busy timeout.
+        """
+        bytes_before = self._database_bytes()
+        report = {
+            "checkpoints_deleted": self.prune_checkpoints(keep, batched=background),
+            "writes_deleted": self.delete_orphaned_writes(BACKGROUND_BATCH_SIZE if background else None),
+            "cache_entries_expired": self.llm_cache.purge_expired(),
+        }
+        if compact_vectors:
+            report["vector_rows_dropped"] = self.saver.vectors.compact()
+        if vacuum:
+            self.vacuum(vacuum_pages, full=not background)
+        bytes_after = self._database_bytes()
+        report.update({
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_reclaimed": bytes_before - bytes_after,
+        })
+        logging.info(f"Checkpoint maintenance: {report}")
+        return report
+
+
+def start_background_maintenance(db_path, interval, keep=DEFAULT_KEEP, vacuum_pages=BACKGROUND_VACUUM_PAGES):
+    """Run maintenance every `interval` seconds in a daemon thread, never a full VACUUM. Returns a stop event"""
+    stop = threading.Event()
+
+    def loop():
+        conn = connect(db_path)
+        try:
+            engine = RetentionEngine(conn)
+            while not stop.wait(interval):
+                try:
+                    engine.run(keep=keep, vacuum_pages=vacuum_pages, background=True)
+                except Exception:
+                    logging.exception("Background checkpoint maintenance failed")
+        finally:
+            conn.close()
+
+    threading.Thread(target=loop, name="checkpoint-maintenance", daemon=True).start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prune and compact the checkpoint database")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="path to the checkpoint database")
+    parser.add_argument("--keep", type=int, default=DEFAULT_KEEP, help="checkpoints kept per thread")
+    parser.add_argument("--no-vacuum", action="store_true", help="skip releasing free pages")
+    parser.add_argument("--vacuum-pages", type=int, default=DEFAULT_VACUUM_PAGES, help="free pages released per run")
+    parser.add_argument("--delete-thread", action="append", default=[], metavar="THREAD_ID", help="delete a thread entirely")
+    parser.add_argument("--rebuild-search", action="store_true", help="reindex every message for search")
+    parser.add_argument("--compact-vectors", action="store_true", help="drop deleted threads from the vector file, with the app stopped")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = connect(args.db)
+    try:
+        engine = RetentionEngine(conn)
+        for thread_id in args.delete_thread:
+            engine.delete_thread(thread_id)
+        if args.rebuild_search:
+            engine.saver.rebuild_search()
+        report = engine.run(
+            keep=args.keep,
+            vacuum=not args.no_vacuum,
+            vacuum_pages=args.vacuum_pages,
+            compact_vectors=args.compact_vectors,
+        )
+        report["threads_deleted"] = len(args.delete_thread)
+        print(json.dumps(report))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Recent events kept in memory, older ones only count towards the totals
+METRICS_BUFFER_SIZE = 1000
+
+# Numeric event fields summed into Prometheus counters
+COUNTED_FIELDS = ("input_tokens", "output_tokens", "bytes")
+
+
+class MetricsRecorder:
+    """Ring buffer of timed operations: graph nodes, LLM calls and storage calls.
+
+    Each event is a dict with kind, name, thread_id, start (epoch seconds),
+    duration (seconds) and optional fields such as token counts or bytes.
+    Running totals per (kind, name) survive the buffer for Prometheus.
+    """
+
+    def __init__(self, size=METRICS_BUFFER_SIZE):
+        self.events = deque(maxlen=size)
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, duration, thread_id=None, start=None, **fields):
+        event = {
+            "kind": kind,
+            "name": name,
+            "thread_id": thread_id,
+            "start": start if start is not None else time.time() - duration,
+            "duration": duration,
+            **fields,
+        }
+        with self.lock:
+            self.events.append(event)
+            totals = self.totals.setdefault((kind, name), {"count": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += duration
+            for field in COUNTED_FIELDS:
+                if fields.get(field):
+                    totals[field] = totals.get(field, 0) + fields[field]
+        return event
+
+    @contextmanager
+    def timed(self, kind, name, thread_id=None, **fields):
+        """Time the block and record it, the yielded dict takes fields known only at the end"""
+        start = time.time()
+        t0 = time.perf_counter()
+        extra = dict(fields)
+        try:
+            yield extra
+        finally:
+            self.record(kind, name, time.perf_counter() - t0, thread_id=thread_id, start=start, **extra)
+
+    def recent(self, thread_id=None, since=None):
+        """Return buffered events, oldest first, optionally of one thread or from a start time"""
+        with self.lock:
+            events = list(self.events)
+        return [
+            e for e in events
+            if (thread_id is None or e["thread_id"] == thread_id)
+            and (since is None or e["start"] >= since)
+        ]
+
+    def last_turn(self, thread_id):
+        """Return the events of the thread's latest turn by start time, including background work after it"""
+        events = self.recent(thread_id)
+        turns = [e for e in events if e["kind"] == "turn"]
+        if not turns:
+            return []
+        # Events are recorded when they end, the turn itself last
+        return sorted((e for e in events if e["start"] >= turns[-1]["start"]), key=lambda e: e["start"])
+
+    def to_jsonl(self, events=None):
+        events = self.recent() if events is None else events
+        return "".join(json.dumps(e, default=str) + "\n" for e in events)
+
+    def to_prometheus(self):
+        """Render the running totals in the Prometheus text exposition format"""
+        with self.lock:
+            totals = {key: dict(value) for key, value in self.totals.items()}
+        lines = [
+            "# HELP assistant_operation_seconds Time spent in instrumented operations",
+            "# TYPE assistant_operation_seconds summary",
+        ]
+        for (kind, name), value in sorted(totals.items()):
+            labels = f'kind="{kind}",name="{name}"'
+            lines.append(f"assistant_operation_seconds_sum{{{labels}}} {value['seconds']:.6f}")
+            lines.append(f"assistant_operation_seconds_count{{{labels}}} {value['count']}")
+        for field in COUNTED_FIELDS:
+            lines.append(f"# TYPE assistant_{field}_total counter")
+            for (kind, name), value in sorted(totals.items()):
+                if field in value:
+                    lines.append(f'assistant_{field}_total{{kind="{kind}",name="{name}"}} {value[field]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every assistant and saver in the process
+recorder = MetricsRecorder()
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics in Prometheus text format from a daemon thread. Returns the server"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = recorder.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
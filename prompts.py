@@ -5,15 +5,29 @@ Continue the conversation from the last message."""
 
 INITIAL_SYSTEM_PROMPT = """You are an helpful assistant."""
 
+RETRIEVAL_PROMPT = """
+Here are excerpts from earlier in the conversation that may be relevant:
+{snippets}"""
+
 # Summarization prompts
 SUMMARY_WITH_EXISTING = """
-This is a summary of the conversation up to this point: {summary}.\n\n
-Create a NEW comprehensive summary that INCORPORATES BOTH the existing summary 
-and the latest messages. PRESERVE ALL IMPORTANT DETAILS from the existing summary 
-while adding new information from the recent messages.
+This is a summary of the conversation before these messages: {summary}.\n\n
+Summarize ONLY the new information in the messages above. Do not repeat the 
+existing summary, it is kept separately. Include all key details and facts about the user,
+in at most {max_words} words.
 """
 
-INITIAL_SUMMARY_PROMPT = """Create a comprehensive summary of the conversation up to this point. Include all key details and facts about the user."""
+INITIAL_SUMMARY_PROMPT = """Create a comprehensive summary of the conversation up to this point. Include all key details and facts about the user, in at most {max_words} words."""
+
+MERGE_SUMMARY_PROMPT = """
+Here is an older summary of a conversation: {summary}
+
+And here are summaries of what was discussed after it, oldest first:
+{segments}
+
+Merge them into ONE summary of at most {max_words} words. PRESERVE the key details 
+and facts about the user, drop small talk and details that were later superseded.
+"""
 
 # Title generation prompt
 TITLE_GENERATION_PROMPT = """
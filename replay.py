@@ -0,0 +1,168 @@
+"""Replay scripted conversations through the assistant without the GUI.
+
+Each line of the input is a JSON object with a thread and its user turns:
+
+    {"thread_id": "support-1", "turns": ["Hi", "How do I reset my password?"]}
+
+or one turn per line, replayed in file order within each thread:
+
+    {"thread_id": "support-1", "message": "Hi"}
+
+Threads run concurrently, the turns of one thread in order:
+
+    python replay.py conversations.jsonl --workers 32 --concurrency 16 --rps 5
+    python replay.py conversations.jsonl --model fake --new-threads --json
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from assistant import Assistant
+from storage import Storage, DEFAULT_DB_PATH
+from benchmarks import percentile
+
+
+def load_conversations(path):
+    """Return an ordered mapping of thread id to its list of user turns"""
+    conversations = OrderedDict()
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "thread_id" not in record:
+                raise ValueError(f"Line {number}: missing thread_id")
+            turns = record["turns"] if "turns" in record else [record["message"]]
+            conversations.setdefault(str(record["thread_id"]), []).extend(turns)
+    return conversations
+
+
+class ReplayRunner:
+    """Runs conversations on a worker pool, at most `concurrency` turns in flight"""
+
+    def __init__(self, llm, storage, workers=8, concurrency=None, memory_length=10):
+        self.llm = llm
+        self.storage = storage
+        self.workers = workers
+        self.memory_length = memory_length
+        self.slots = threading.BoundedSemaphore(concurrency or workers)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.first_tokens = []
+        self.errors = []
+
+    def _conversation(self, thread_id, turns):
+        assistant = Assistant(self.llm, thread_id=thread_id, memoryLenght=self.memory_length, storage=self.storage)
+        for turn in turns:
+            with self.slots:
+                start = time.perf_counter()
+                try:
+                    for _ in assistant.get_response(turn):
+                        pass
+                except Exception as e:
+                    with self.lock:
+                        self.errors.append({"thread_id": thread_id, "error": str(e)})
+                    continue
+                latency = time.perf_counter() - start
+            with self.lock:
+                self.latencies.append(latency)
+                if "time_to_first_token" in assistant.last_metrics:
+                    self.first_tokens.append(assistant.last_metrics["time_to_first_token"])
+        # Titles and summaries still write checkpoints, let them land before finishing
+        assistant.wait_for_background()
+
+    def run(self, conversations):
+        """Replay every conversation and return a report"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="replay") as pool:
+            futures = [pool.submit(self._conversation, t, turns) for t, turns in conversations.items()]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(self.latencies)
+        report = {
+            "threads": len(conversations),
+            "turns": len(latencies),
+            "errors": len(self.errors),
+            "elapsed": round(elapsed, 3),
+            "turns_per_second": round(len(latencies) / elapsed, 3) if elapsed else None,
+        }
+        for q in (50, 90, 95, 99):
+            value = percentile(latencies, q)
+            report[f"latency_p{q}"] = round(value, 4) if value is not None else None
+        for q in (50, 95):
+            value = percentile(sorted(self.first_tokens), q)
+            report[f"first_token_p{q}"] = round(value, 4) if value is not None else None
+        return report
+
+
+def make_llm(model, base_url=None, rps=None, latency=0.0):
+    """Build the chat model: "fake" for the offline fake, otherwise an OpenAI-compatible model"""
+    if model == "fake":
+        from benchmarks.fakes import FakeChatModel
+        llm = FakeChatModel(latency=latency)
+    else:
+        from langchain_openai import ChatOpenAI
+        # base_url points at a local OpenAI-compatible server, e.g. vLLM or Ollama
+        llm = ChatOpenAI(model=model, base_url=base_url) if base_url else ChatOpenAI(model=model)
+    if rps:
+        # Every LLM call of the run, including titles and summaries, shares this budget
+        llm.rate_limiter = InMemoryRateLimiter(requests_per_second=rps, max_bucket_size=max(1, rps))
+    return llm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay JSONL conversations through the assistant")
+    parser.add_argument("path", help="JSONL file of conversations")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="path to the checkpoint database")
+    parser.add_argument("--model", default="gpt-4", help='chat model name, or "fake" for an offline echo model')
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"), help="OpenAI-compatible endpoint of a local model")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="seconds the fake model takes per call")
+    parser.add_argument("--workers", type=int, default=8, help="conversations replayed at once")
+    parser.add_argument("--concurrency", type=int, default=None, help="turns in flight at once, defaults to --workers")
+    parser.add_argument("--rps", type=float, default=None, help="LLM requests per second across the run")
+    parser.add_argument("--memory-length", type=int, default=10, help="messages kept before summarizing")
+    parser.add_argument("--new-threads", action="store_true", help="replay into fresh thread ids instead of extending existing threads")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the file this many times, each into fresh threads")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    conversations = load_conversations(args.path)
+    if args.new_threads or args.repeat > 1:
+        runs = [uuid.uuid4().hex[:8] for _ in range(args.repeat)]
+        conversations = OrderedDict(
+            (f"{thread_id}-{run}", turns) for run in runs for thread_id, turns in conversations.items()
+        )
+
+    storage = Storage(args.db)
+    try:
+        runner = ReplayRunner(
+            make_llm(args.model, args.base_url, args.rps, args.fake_latency),
+            storage,
+            workers=args.workers,
+            concurrency=args.concurrency,
+            memory_length=args.memory_length,
+        )
+        report = runner.run(conversations)
+    finally:
+        storage.close()
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:>18}: {value}")
+    for error in runner.errors[:10]:
+        logging.warning(f"Turn failed in {error['thread_id']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+import zlib
+import numpy as np
+from transcript import content_text
+
+
+# Dimension of the hashed embeddings
+EMBEDDING_DIM = 1024
+
+# Consecutive archived messages embedded together, e.g. a question and its answer
+CHUNK_MESSAGES = 2
+
+# Characters of a chunk kept for embedding and for the prompt
+CHUNK_CHARS = 1000
+
+# Rows scored per matrix product during search
+SEARCH_BATCH = 65536
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words too common to tell chunks apart
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have he her his how i if in is it its
+me my of on or our she so that the their them there they this to was we were what when where
+which who why will with you your
+""".split())
+
+
+class HashingEmbedder:
+    """Offline text embeddings from hashed word unigrams and bigrams.
+
+    No model or network is needed, and crc32 keeps the hashes stable across processes.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        words = [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        """Return an (n, dim) float32 array of L2-normalized embeddings"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+            # The bit above the bucket index picks the sign, so collisions tend to cancel out
+            signs = np.where((hashes // self.dim) & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[i], hashes % self.dim, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """Embeddings of archived message chunks for per-thread retrieval.
+
+    Vectors are float16 rows of a file next to the database, read through a
+    memory map, chunk texts and their thread live in SQLite. Row numbers are
+    allocated inside the SQLite write transaction, so several processes or
+    Storage instances can add to the same index.
+    """
+
+    def __init__(self, saver, reader, path, embedder=None):
+        self.saver = saver
+        self.reader = reader
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self.dim = self.embedder.dim
+        self.lock = threading.Lock()
+        self._vectors = None
+
+    def setup(self, cur):
+        """Create the chunk table. Returns True if it did not exist yet"""
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vector_chunks'")
+        created = cur.fetchone() is None
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS vector_chunks (
+                row INTEGER PRIMARY KEY,
+                thread_id TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS vector_chunks_thread ON vector_chunks (thread_id);
+            """
+        )
+        return created
+
+    def _row_count(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dim * 2)
+
+    def _load_vectors(self, min_rows):
+        """Memory-map the vector file, remapping only when it has grown"""
+        with self.lock:
+            if self._vectors is None or len(self._vectors) < min_rows:
+                rows = self._row_count()
+                self._vectors = np.memmap(self.path, dtype=np.float16, mode="r", shape=(rows, self.dim)) if rows else None
+            return self._vectors
+
+    def _chunks(self, messages):
+        """Yield (text to embed, text for the prompt) per group of messages"""
+        for start in range(0, len(messages), CHUNK_MESSAGES):
+            group = messages[start:start + CHUNK_MESSAGES]
+            content = "\n".join(content_text(m.content) for m in group)[:CHUNK_CHARS]
+            if content.strip():
+                yield content, "\n".join(f"{m.type}: {content_text(m.content)}" for m in group)[:CHUNK_CHARS]
+
+    def _write_lock(self, cur):
+        """Take SQLite's write lock unless the transaction already holds it"""
+        if not cur.connection.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+
+    def add(self, thread_id, messages, cur=None):
+        """Embed archived messages and add them to the index"""
+        chunks = list(self._chunks(messages))
+        if not chunks:
+            return
+        texts = [text for _, text in chunks]
+        vectors = self.embedder.embed([content for content, _ in chunks]).astype(np.float16)
+        if cur is not None:
+            self._insert(cur, thread_id, texts, vectors)
+        else:
+            with self.saver.cursor() as cur:
+                self._insert(cur, thread_id, texts, vectors)
+
+    def _insert(self, cur, thread_id, texts, vectors):
+        # Rows are allocated and written under the write lock, other writers wait for the commit
+        self._write_lock(cur)
+        cur.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM vector_chunks")
+        first_row = cur.fetchone()[0]
+        with self.lock:
+            # Rows of deleted chunks at the end of the file are reused
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, "r+b") as f:
+                f.seek(first_row * self.dim * 2)
+                f.write(vectors.tobytes())
+        # A plain INSERT, a row taken twice must fail rather than overwrite a chunk
+        cur.executemany(
+            "INSERT INTO vector_chunks (row, thread_id, text) VALUES (?, ?, ?)",
+            [(first_row + i, str(thread_id), text) for i, text in enumerate(texts)],
+        )
+
+    def search(self, thread_id, query, k=3, min_score=0.1):
+        """Return up to k (score, text) pairs of the thread most similar to the query"""
+        if not query.strip():
+            return []
+        cur = self.reader.cursor()
+        # Only row numbers are needed to score, texts are fetched for the top k
+        cur.execute("SELECT row FROM vector_chunks WHERE thread_id = ? ORDER BY row", (str(thread_id),))
+        rows = np.fromiter((row for (row,) in cur.fetchall()), dtype=np.int64)
+        if not len(rows):
+            return []
+
+        vectors = self._load_vectors(int(rows[-1]) + 1)
+        if vectors is None:
+            return []
+        # Rows past the end of the file were lost before being written, skip them
+        rows = rows[rows < len(vectors)]
+
+        query_vector = self.embedder.embed([query])[0]
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BATCH):
+            batch = np.asarray(vectors[rows[start:start + SEARCH_BATCH]], dtype=np.float32)
+            scores[start:start + SEARCH_BATCH] = batch @ query_vector
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = [i for i in top[np.argsort(-scores[top])] if scores[i] >= min_score]
+        if not top:
+            return []
+        top_rows = [int(rows[i]) for i in top]
+        cur.execute(
+            f"SELECT row, text FROM vector_chunks WHERE row IN ({', '.join('?' * len(top_rows))})",
+            top_rows,
+        )
+        texts = dict(cur.fetchall())
+        return [(float(scores[i]), texts[row]) for i, row in zip(top, top_rows) if row in texts]
+
+    def delete(self, thread_id, cur):
+        # The vectors stay in the file but can no longer be found, compact() drops them
+        cur.execute("DELETE FROM vector_chunks WHERE thread_id = ?", (str(thread_id),))
+
+    def file_bytes(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def compact(self):
+        """Rewrite the vector file without rows no chunk refers to. Returns the number of rows dropped.
+
+        Rows are renumbered, so no other process may use the index meanwhile.
+        """
+        tmp_path = f"{self.path}.tmp"
+        # Same lock order as add(): the saver's lock, SQLite's write lock, then the file's
+        with self.saver.cursor() as cur, self.lock:
+            self._write_lock(cur)
+            total = self._row_count()
+            cur.execute("SELECT row FROM vector_chunks WHERE row < ? ORDER BY row", (total,))
+            rows = [row for (row,) in cur.fetchall()]
+            if len(rows) == total:
+                return 0
+            vectors = np.memmap(self.path, dtype=np.float16, mode="r", shape=(total, self.dim))
+            with open(tmp_path, "wb") as f:
+                for start in range(0, len(rows), SEARCH_BATCH):
+                    f.write(np.asarray(vectors[rows[start:start + SEARCH_BATCH]]).tobytes())
+            del vectors
+            # Chunks whose vectors were never written can't be found anyway
+            cur.execute("DELETE FROM vector_chunks WHERE row >= ?", (total,))
+            # New row numbers are never above the old ones, so ascending updates don't collide
+            cur.executemany(
+                "UPDATE vector_chunks SET row = ? WHERE row = ?",
+                [(new, old) for new, old in enumerate(rows) if new != old],
+            )
+            # Swapped in before the renumbering commits, both change under the write lock
+            os.replace(tmp_path, self.path)
+            self._vectors = None
+        return total - len(rows)
+
+    def backfill(self, cur, transcript):
+        """Index every thread's existing transcript"""
+        cur.execute("SELECT DISTINCT thread_id FROM transcript")
+        for (thread_id,) in cur.fetchall():
+            self.add(thread_id, transcript.read(thread_id), cur)
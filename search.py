@@ -0,0 +1,183 @@
+import logging
+import sqlite3
+from transcript import content_text
+
+
+# Tokens of context around the match in a result snippet
+SNIPPET_TOKENS = 12
+
+# Only the latest matches are ranked, so very common terms stay fast
+RANK_WINDOW = 2000
+
+# The last word is matched as a prefix from this length
+MIN_PREFIX_CHARS = 2
+
+# Longest prefix the FTS index covers (prefix='2 3'), longer ones scan every matching term
+MAX_INDEXED_PREFIX_CHARS = 3
+
+# Markers around matched terms in snippets, bold in Markdown
+HIGHLIGHT = ("**", "**")
+
+
+def _match_query(text, prefix):
+    """Turn user input into an FTS5 query: every word must match, the last one as a prefix if asked"""
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _last_word_length(text):
+    words = text.split()
+    return len(words[-1]) if words else 0
+
+
+def _documents(messages):
+    """Yield (message_id, role, text) of the messages worth indexing"""
+    for msg in messages:
+        if msg.type not in ("human", "ai") or not msg.id:
+            continue
+        content = content_text(msg.content)
+        if content.strip():
+            yield msg.id, msg.type, content
+
+
+class MessageSearch:
+    """Full-text index over the messages of every thread.
+
+    Messages are indexed once per (thread_id, message_id) as checkpoints are
+    written, so they stay searchable after being archived to the transcript.
+    search_docs holds the text, message_search is an FTS5 index over it.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.available = True
+
+    def setup(self, cur):
+        """Create the index tables. Returns True if they did not exist yet"""
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='search_docs'")
+        created = cur.fetchone() is None
+        try:
+            cur.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS search_docs (
+                    rowid INTEGER PRIMARY KEY,
+                    thread_id TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    UNIQUE (thread_id, message_id)
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                    content, content='search_docs', content_rowid='rowid', prefix='2 3'
+                );
+                """
+            )
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5 keep working, just without search
+            logging.warning(f"Message search unavailable: {str(e)}")
+            self.available = False
+            return False
+        return created
+
+    def add(self, cur, thread_id, messages):
+        """Index messages not indexed yet for the thread"""
+        if not self.available:
+            return
+        for message_id, role, content in _documents(messages):
+            cur.execute(
+                "INSERT OR IGNORE INTO search_docs (thread_id, message_id, role, content) VALUES (?, ?, ?, ?)",
+                (str(thread_id), message_id, role, content),
+            )
+            if cur.rowcount:
+                cur.execute("INSERT INTO message_search (rowid, content) VALUES (?, ?)", (cur.lastrowid, content))
+
+    def search(self, text, limit=20):
+        """Return the best match per thread, best first, as dicts with a highlighted snippet.
+
+        Ranking is by bm25 among the latest RANK_WINDOW matching messages. A
+        short last word is matched as an indexed prefix, a longer one as a whole
+        word first and as a prefix only when that finds nothing.
+        """
+        if not self.available or not text.split():
+            return []
+        length = _last_word_length(text)
+        if MIN_PREFIX_CHARS <= length <= MAX_INDEXED_PREFIX_CHARS:
+            return self._search(_match_query(text, prefix=True), limit)
+        results = self._search(_match_query(text, prefix=False), limit)
+        if not results and length >= MIN_PREFIX_CHARS:
+            results = self._search(_match_query(text, prefix=True), limit)
+        return results
+
+    def _search(self, query, limit):
+        cur = self.conn.cursor()
+        # Rowids grow with time, find where the latest RANK_WINDOW matches start
+        cur.execute(
+            "SELECT rowid FROM message_search WHERE message_search MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+            (query, RANK_WINDOW - 1),
+        )
+        row = cur.fetchone()
+        cutoff = row[0] if row else 0
+        cur.execute(
+            f"""
+            SELECT d.thread_id, d.message_id, d.role, t.title,
+                snippet(message_search, 0, ?, ?, '…', {SNIPPET_TOKENS}), message_search.rank
+            FROM message_search
+            JOIN search_docs d ON d.rowid = message_search.rowid
+            LEFT JOIN threads t ON t.thread_id = d.thread_id
+            WHERE message_search MATCH ? AND message_search.rowid >= ?
+            ORDER BY message_search.rank
+            LIMIT ?
+            """,
+            (*HIGHLIGHT, query, cutoff, limit * 5),
+        )
+        results = {}
+        for thread_id, message_id, role, title, snippet, rank in cur.fetchall():
+            if thread_id not in results and len(results) < limit:
+                results[thread_id] = {
+                    "thread_id": thread_id,
+                    "message_id": message_id,
+                    "role": role,
+                    "title": title,
+                    "snippet": snippet,
+                    "rank": rank,
+                }
+        return list(results.values())
+
+    def delete(self, thread_id, cur):
+        if not self.available:
+            return
+        cur.execute("SELECT rowid, content FROM search_docs WHERE thread_id = ?", (str(thread_id),))
+        rows = cur.fetchall()
+        cur.executemany(
+            "INSERT INTO message_search (message_search, rowid, content) VALUES ('delete', ?, ?)", rows
+        )
+        cur.execute("DELETE FROM search_docs WHERE thread_id = ?", (str(thread_id),))
+
+    def rebuild(self, cur, checkpoints):
+        """Reindex every thread from its transcript and the messages in its latest checkpoint.
+
+        Takes the (thread_id, checkpoint) pairs of each thread's latest checkpoint.
+        """
+        if not self.available:
+            return
+        cur.execute("DELETE FROM search_docs")
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO search_docs (thread_id, message_id, role, content)
+            SELECT thread_id, message_id, role, content FROM transcript
+            WHERE message_id IS NOT NULL AND role IN ('human', 'ai') AND content != ''
+            """
+        )
+        for thread_id, checkpoint in checkpoints:
+            messages = checkpoint.get("channel_values", {}).get("messages") or []
+            cur.executemany(
+                "INSERT OR IGNORE INTO search_docs (thread_id, message_id, role, content) VALUES (?, ?, ?, ?)",
+                [(str(thread_id), *doc) for doc in _documents(messages)],
+            )
+        # Rebuild the FTS index from search_docs in one pass
+        cur.execute("INSERT INTO message_search (message_search) VALUES ('rebuild')")
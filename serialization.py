@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+import zlib
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+load_dotenv()
+
+# Compression of new checkpoints: zstd, zlib or none. Any of them can be read back
+DEFAULT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "zstd")
+
+# zstd's default level, a good balance of speed and ratio
+ZSTD_LEVEL = 3
+
+# zlib's default level
+ZLIB_LEVEL = 6
+
+# Blobs smaller than this are stored as is, compressing them saves next to nothing
+MIN_COMPRESS_BYTES = 256
+
+COMPRESSIONS = ("zstd", "zlib")
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """Checkpoint serializer that compresses the msgpack encoding of JsonPlusSerializer.
+
+    Compressed blobs are tagged "<type>+zstd" or "<type>+zlib". Tags without a
+    suffix are plain JsonPlusSerializer output, so checkpoints written before
+    load unchanged.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION, **kwargs):
+        super().__init__(**kwargs)
+        if compression == "zstd" and zstandard is None:
+            logging.warning("zstandard is not installed, compressing checkpoints with zlib")
+            compression = "zlib"
+        if compression not in COMPRESSIONS:
+            compression = None
+        self.compression = compression
+        # zstd contexts are not thread safe, keep one per thread
+        self._local = threading.local()
+
+    def _zstd(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local
+
+    def _compress(self, data):
+        if self.compression == "zstd":
+            return self._zstd().compressor.compress(data)
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    def _decompress(self, compression, data):
+        if compression == "zlib":
+            return zlib.decompress(data)
+        if zstandard is None:
+            raise ValueError("Checkpoint is zstd compressed, install zstandard to read it")
+        return self._zstd().decompressor.decompress(data)
+
+    def dumps_typed(self, obj):
+        type_, data = super().dumps_typed(obj)
+        if self.compression is None or len(data) < MIN_COMPRESS_BYTES:
+            return type_, data
+        compressed = self._compress(data)
+        if len(compressed) >= len(data):
+            return type_, data
+        return f"{type_}+{self.compression}", compressed
+
+    def loads_typed(self, data):
+        type_, payload = data
+        base, _, compression = type_.rpartition("+")
+        if base and compression in COMPRESSIONS:
+            return super().loads_typed((base, self._decompress(compression, payload)))
+        return super().loads_typed(data)
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import aiosqlite
+from dotenv import load_dotenv
+from catalog import AsyncCatalogSqliteSaver, CatalogSqliteSaver, ThreadCatalog
+from transcript import TranscriptStore
+from search import MessageSearch
+from llm_cache import LLMCache
+
+
+load_dotenv()
+
+# Path of the checkpoint database, override with CHECKPOINT_DB_PATH
+DEFAULT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "checkpoints.sqlite")
+
+# How long a connection waits for a lock held by another writer
+BUSY_TIMEOUT_MS = 5000
+
+# NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+SYNCHRONOUS = "NORMAL"
+
+
+def connect(db_path=DEFAULT_DB_PATH, read_only=False):
+    """Open a connection configured for concurrent use from several threads"""
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+    if not read_only:
+        # Only takes effect on a new database, before its first table, and lets
+        # maintenance release free pages without a full VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+async def aconnect(db_path=DEFAULT_DB_PATH):
+    """Open an aiosqlite connection configured like connect()"""
+    conn = aiosqlite.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    # Its worker thread would otherwise keep the process alive at exit,
+    # every write is committed so nothing is lost when it is cut short
+    getattr(conn, "_thread", conn).daemon = True
+    await conn
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    await conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    return conn
+
+
+class Storage:
+    """Process-wide SQLite storage shared by the GUI and every Assistant.
+
+    Checkpoints of graphs run with ainvoke/astream are written through an
+    async saver on its own aiosqlite connection, one per event loop since
+    those connections are bound to their loop. The catalog, transcript, search
+    and vector rows are written through the sync saver's connection, which
+    serializes them with its lock, and SQLite's write lock orders the two.
+    Sidebar and transcript reads use a separate read-only connection so they
+    don't queue behind writes in WAL mode.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, serde=None):
+        self.db_path = db_path
+        self.conn = connect(db_path)
+        # serde defaults to CompactSerializer, see CatalogSqliteSaver
+        self.saver = CatalogSqliteSaver(self.conn, serde=serde)
+        self.saver.setup()
+
+        self.reader = connect(db_path, read_only=True)
+        self.catalog = ThreadCatalog(self.reader)
+        self.transcript = TranscriptStore(self.reader)
+        self.search = MessageSearch(self.reader)
+        self.search.available = self.saver.search.available
+
+        # Retrieval index owned by the saver, searched through the read-only connection
+        self.vectors = self.saver.vectors
+        self.vectors.reader = self.reader
+
+        # LLM responses reused by the call sites an Assistant enables it for
+        self.llm_cache = LLMCache(self.saver)
+        with self.saver.cursor() as cur:
+            self.llm_cache.setup(cur)
+
+        self._async_savers = {}
+        self._async_lock = threading.Lock()
+
+    async def async_saver(self):
+        """Return the async checkpoint saver for the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            saver = self._async_savers.get(loop)
+        if saver is not None:
+            return saver
+
+        saver = AsyncCatalogSqliteSaver(await aconnect(self.db_path), self.saver)
+        await saver.setup()
+        with self._async_lock:
+            # Forget savers of loops that have been closed since
+            for closed in [l for l in self._async_savers if l.is_closed()]:
+                self._async_savers.pop(closed).conn.stop()
+            existing = self._async_savers.setdefault(loop, saver)
+        if existing is not saver:
+            # Another task on this loop opened one first
+            await saver.conn.close()
+        return existing
+
+    def close(self):
+        with self._async_lock:
+            for saver in self._async_savers.values():
+                saver.conn.stop()
+            self._async_savers.clear()
+        self.reader.close()
+        self.conn.close()
@@ -0,0 +1,64 @@
+import logging
+from functools import lru_cache
+from transcript import content_text
+
+
+# Encoding used by GPT-4 and GPT-3.5 models
+ENCODING_NAME = "cl100k_base"
+
+# Tokens the chat format adds around each message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Key under which a message's token count is cached in its response_metadata
+TOKEN_COUNT_KEY = "token_count"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails offline
+        logging.warning(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+        return None
+
+
+@lru_cache(maxsize=64)
+def count_tokens(text):
+    """Count the tokens of a text, estimating ~4 characters per token without tiktoken"""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    """Return a message's token count, reusing the one saved with it if any"""
+    cached = message.response_metadata.get(TOKEN_COUNT_KEY)
+    if cached is None:
+        cached = count_tokens(content_text(message.content)) + MESSAGE_OVERHEAD_TOKENS
+    return cached
+
+
+def with_token_count(message):
+    """Return the message with its token count in response_metadata, a copy if it had none.
+
+    Returned from a node, the copy replaces the message by id, so the count
+    is saved with the checkpoint and later turns reuse it.
+    """
+    if TOKEN_COUNT_KEY in message.response_metadata:
+        return message
+    metadata = {**message.response_metadata, TOKEN_COUNT_KEY: message_tokens(message)}
+    return message.model_copy(update={"response_metadata": metadata})
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut a text down to at most max_tokens tokens, keeping its beginning"""
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,98 @@
+import json
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+
+def content_text(content):
+    """Flatten message content (a string or a list of content blocks) to text"""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content:
+        if isinstance(block, str):
+            parts.append(block)
+        elif isinstance(block, dict) and block.get("type") == "text":
+            parts.append(block.get("text", ""))
+    return "".join(parts)
+
+
+class TranscriptStore:
+    """Append-only archive of messages pruned from a thread's state, one row per message"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def setup(self, cur=None):
+        """Create the transcript table. Returns True if it did not exist yet"""
+        cur = cur or self.conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transcript'")
+        created = cur.fetchone() is None
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS transcript (
+                thread_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message_id TEXT,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (thread_id, seq)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS transcript_message_id ON transcript (thread_id, message_id);
+            """
+        )
+        return created
+
+    def append(self, cur, thread_id, messages):
+        """Archive messages after the thread's last one, skipping ids already archived"""
+        if not messages:
+            return
+        cur.execute("SELECT COALESCE(MAX(seq), -1) FROM transcript WHERE thread_id = ?", (str(thread_id),))
+        next_seq = cur.fetchone()[0] + 1
+        rows = []
+        for msg in messages:
+            rows.append((
+                str(thread_id),
+                next_seq,
+                msg.id,
+                msg.type,
+                content_text(msg.content),
+                json.dumps(message_to_dict(msg)),
+            ))
+            next_seq += 1
+        cur.executemany(
+            "INSERT OR IGNORE INTO transcript (thread_id, seq, message_id, role, content, data) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def count(self, thread_id, cur=None):
+        cur = cur or self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM transcript WHERE thread_id = ?", (str(thread_id),))
+        return cur.fetchone()[0]
+
+    def read(self, thread_id, limit=None):
+        """Return archived messages of a thread in order, only the last `limit` if given"""
+        cur = self.conn.cursor()
+        if limit is None:
+            cur.execute("SELECT data FROM transcript WHERE thread_id = ? ORDER BY seq", (str(thread_id),))
+            rows = cur.fetchall()
+        else:
+            # Walk the primary key backwards so only the requested page is read
+            cur.execute(
+                "SELECT data FROM transcript WHERE thread_id = ? ORDER BY seq DESC LIMIT ?",
+                (str(thread_id), limit),
+            )
+            rows = cur.fetchall()[::-1]
+        return messages_from_dict([json.loads(data) for (data,) in rows])
+
+    def delete(self, thread_id, cur=None):
+        cur = cur or self.conn.cursor()
+        cur.execute("DELETE FROM transcript WHERE thread_id = ?", (str(thread_id),))
+
+    def migrate_full_history(self, cur, checkpoints):
+        """Copy the full_history lists kept in thread state into the transcript.
+
+        Takes the (thread_id, checkpoint) pairs of each thread's latest checkpoint.
+        """
+        for thread_id, checkpoint in checkpoints:
+            full_history = checkpoint.get("channel_values", {}).get("full_history") or []
+            self.append(cur, thread_id, full_history)